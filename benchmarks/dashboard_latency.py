@@ -0,0 +1,101 @@
+"""
+Benchmark the latency of the dashboard's graph callback under concurrent requests. Random
+selections of replicates, metric and steps are posted to the Dash update endpoint through Flask's
+test client from a pool of threads. Every selection is requested once with empty caches, then
+repeatedly as users switching between views would, and the p50/p99 latencies of both passes are
+reported. Run after compacting the particle data.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def __request_body(replicates: list, metric: str, steps: list) -> dict:
+    return {
+        "output": "particle-tracking-graph.figure",
+        "outputs": {"id": "particle-tracking-graph", "property": "figure"},
+        "inputs": [
+            {"id": "replicates-checklist", "property": "value", "value": replicates},
+            {"id": "metrics-radioitems", "property": "value", "value": metric},
+            {"id": "steps-dropdown", "property": "value", "value": steps},
+        ],
+        "changedPropIds": ["steps-dropdown.value"],
+        "state": [],
+    }
+
+
+def __selections(manifest: dict, metrics: list, n: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    replicates, steps = manifest["replicates"], manifest["steps"]
+
+    return [
+        __request_body(
+            sorted(rng.sample(replicates, rng.randint(1, len(replicates)))),
+            rng.choice(metrics)["value"],
+            sorted(rng.sample(steps, rng.randint(1, len(steps))), reverse=True),
+        )
+        for _ in range(n)
+    ]
+
+
+def __run(client, url: str, bodies: list[dict], concurrency: int) -> np.ndarray:
+    def __post(body: dict) -> float:
+        start = time.perf_counter()
+        response = client.post(url, json=body)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return np.array(list(pool.map(__post, bodies)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data-format",
+        type=str,
+        choices=["parquet", "arrow"],
+        default="arrow",
+        help="Scan the partitioned Parquet dataset or the shared Arrow file",
+    )
+    parser.add_argument(
+        "--selections", type=int, default=32, help="Number of distinct selections"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Number of repeated requests"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Number of concurrent requests"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Selection seed")
+    args = parser.parse_args()
+
+    os.environ["PARTICLE_DATA_FORMAT"] = args.data_format
+    start = time.perf_counter()
+    import data_app  # noqa: E402
+
+    print(f"App startup: {time.perf_counter() - start:.2f} s")
+
+    client = data_app.server.test_client()
+    url = f"{data_app.app.config.requests_pathname_prefix}_dash-update-component"
+    bodies = __selections(
+        data_app.manifest, data_app.METRICS, args.selections, args.seed
+    )
+    repeated = random.Random(args.seed).choices(bodies, k=args.requests)
+
+    print(
+        f"{data_app.manifest['rows']} particles, {args.selections} selections, "
+        f"{args.requests} repeated requests, concurrency {args.concurrency}"
+    )
+    for name, requests in [("cold", bodies), ("warm", repeated)]:
+        latencies = __run(client, url, requests, args.concurrency) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{name}: p50 {p50:.1f} ms, p99 {p99:.1f} ms")
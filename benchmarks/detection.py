@@ -0,0 +1,96 @@
+"""
+Benchmark streaming detection against in-memory detection on a synthetic movie whose first blocks
+are blank, and compare the detection tables of both modes for every table format. Blocks without
+features must not change the columns of the streamed table.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from detect_objects import _detection_stage, _streaming_detection_stage  # noqa: E402
+from tables import TABLE_FORMATS, read_table, table_path  # noqa: E402
+
+
+def __synthetic_movie(
+    n_frames: int, blank_frames: int, n_particles: int, size: int, seed: int = 874
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    frames = np.full((n_frames, size, size), 10, dtype=np.uint8)
+
+    yy, xx = np.mgrid[-3:4, -3:4]
+    spot = (200 * np.exp(-(yy**2 + xx**2) / 4)).astype(np.uint8)
+    for t in range(blank_frames, n_frames):
+        for y, x in rng.integers(10, size - 10, size=(n_particles, 2)):
+            frames[t, y - 3 : y + 4, x - 3 : x + 4] = np.maximum(
+                frames[t, y - 3 : y + 4, x - 3 : x + 4], spot
+            )
+
+    return frames
+
+
+def __run(stage, table_format: str, *args) -> tuple[pd.DataFrame, float]:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            start = time.perf_counter()
+            stage(*args, overlay_mode="lazy", table_format=table_format)
+            elapsed = time.perf_counter() - start
+            f = read_table(table_path("detection", table_format))
+        finally:
+            os.chdir(cwd)
+
+    return f, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=80, help="Number of frames")
+    parser.add_argument(
+        "--blank-frames",
+        type=int,
+        default=20,
+        help="Number of leading frames without features",
+    )
+    parser.add_argument(
+        "--particles", type=int, default=50, help="Number of particles per frame"
+    )
+    parser.add_argument("--size", type=int, default=256, help="Frame height and width")
+    args = parser.parse_args()
+
+    frames = __synthetic_movie(
+        args.frames, args.blank_frames, args.particles, args.size
+    )
+    exclude = np.zeros(frames.shape, dtype=bool)
+
+    for table_format in TABLE_FORMATS:
+        expected, in_memory_time = __run(
+            _detection_stage, table_format, frames.copy(), exclude
+        )
+        streamed, streaming_time = __run(
+            _streaming_detection_stage,
+            table_format,
+            da.from_array(frames, chunks=(20, -1, -1)),
+            da.from_array(exclude, chunks=(20, -1, -1)),
+            20,
+        )
+
+        print(
+            f"{table_format}: in memory {in_memory_time:.2f} s, "
+            f"streaming {streaming_time:.2f} s, {len(expected)} features"
+        )
+        assert list(streamed.columns) == list(expected.columns), streamed.columns
+        pd.testing.assert_frame_equal(
+            streamed.reset_index(drop=True), expected.reset_index(drop=True)
+        )
+
+    print("Streaming and in-memory detection tables are identical")
@@ -0,0 +1,51 @@
+"""
+Benchmark the compiled nearest-velocity linker against trackpy's NearestVelocityPredict on the same
+detection table, and compare the resulting tracks.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+import trackpy as tp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from link_objects import (  # noqa: E402
+    LINK_PARAMETERS,
+    MAX_SUB_NET_SIZE,
+    PREDICTOR_SPAN,
+)
+from nv_linker import NearestVelocityLinker  # noqa: E402
+from window_linking import validation_report  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--detection-csv", type=str, required=True, help="Path to detection csv"
+    )
+    args = parser.parse_args()
+
+    f = pd.read_csv(args.detection_csv)
+
+    start = time.perf_counter()
+    pred = tp.predict.NearestVelocityPredict(span=PREDICTOR_SPAN)
+    t_trackpy = pred.link_df(f, **LINK_PARAMETERS)
+    trackpy_time = time.perf_counter() - start
+
+    linker = NearestVelocityLinker(
+        span=PREDICTOR_SPAN, max_sub_net_size=MAX_SUB_NET_SIZE, **LINK_PARAMETERS
+    )
+    # First call compiles the kernels
+    linker.link(f[f["frame"] < f["frame"].min() + 2])
+
+    start = time.perf_counter()
+    t_numba = linker.link(f)
+    numba_time = time.perf_counter() - start
+
+    print(f"{len(f)} detections in {f['frame'].nunique()} frames")
+    print(f"trackpy: {trackpy_time:.2f} s")
+    print(f"numba:   {numba_time:.2f} s ({trackpy_time / numba_time:.1f}x)")
+    print(validation_report(t_trackpy, t_numba, names=("trackpy", "numba")).to_string())
@@ -0,0 +1,77 @@
+"""
+Benchmark the FFT MSD module against trackpy's imsd and emsd on the tracks of a real sample, and
+report the largest differences. Lags of a track without position pairs are NaN in the FFT results
+and zero in trackpy's, those entries are compared as missing.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from calculate_metrics import MAX_LAGTIME, PIXEL_SIZE  # noqa: E402
+from msd import emsd, imsd, msd_table  # noqa: E402
+
+
+def __max_relative_difference(actual: np.ndarray, expected: np.ndarray) -> float:
+    valid = ~np.isnan(actual) & ~np.isnan(expected)
+    if not valid.any():
+        return 0.0
+    difference = np.abs(actual[valid] - expected[valid])
+    return float(np.max(difference / np.maximum(np.abs(expected[valid]), 1e-12)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tracks-csv",
+        type=str,
+        required=True,
+        help="Path to linking.csv or additional-tracking-data.csv of a sample",
+    )
+    parser.add_argument(
+        "--frame-interval", type=float, default=0.02729, help="Seconds per frame"
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.tracks_csv).sort_values(["particle", "frame"])
+    fps = 1 / args.frame_interval
+
+    start = time.perf_counter()
+    expected_imsd = tp.imsd(df, mpp=PIXEL_SIZE, fps=fps, max_lagtime=MAX_LAGTIME)
+    expected_emsd = tp.emsd(df, mpp=PIXEL_SIZE, fps=fps, max_lagtime=MAX_LAGTIME)
+    trackpy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = msd_table(
+        df["particle"].to_numpy(),
+        df["frame"].to_numpy(),
+        df["x"].to_numpy(),
+        df["y"].to_numpy(),
+        PIXEL_SIZE,
+        MAX_LAGTIME,
+    )
+    fft_imsd = imsd(table, fps)
+    fft_emsd = emsd(table, fps)
+    fft_time = time.perf_counter() - start
+
+    assert list(fft_imsd.columns) == list(expected_imsd.columns), "Particles differ"
+    assert np.allclose(fft_imsd.index, expected_imsd.index), "Lag times differ"
+
+    no_pairs = (table["n_pairs"] == 0).sum()
+    print(f"{df['particle'].nunique()} particles, {len(df)} track rows")
+    print(f"Lags without position pairs: {no_pairs} of {len(table)}")
+    for name, actual, expected in [
+        ("imsd", fft_imsd, expected_imsd),
+        ("emsd", fft_emsd, expected_emsd),
+    ]:
+        difference = __max_relative_difference(actual.to_numpy(), expected.to_numpy())
+        print(f"{name} max relative difference: {difference:.2e}")
+    print(f"trackpy: {trackpy_time:.2f} s")
+    print(f"FFT:     {fft_time:.2f} s ({trackpy_time / fft_time:.0f}x)")
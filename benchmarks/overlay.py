@@ -0,0 +1,89 @@
+"""
+Benchmark the vectorized overlay renderer against the previous per-feature drawing loop on synthetic
+frames and features. Both implementations must produce identical overlays.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from skimage import color, draw
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from overlay import OverlayRenderer  # noqa: E402
+
+
+def __draw_detection_overlay(
+    df: pd.DataFrame, frame: np.ndarray, color_dict: dict
+) -> np.ndarray:
+    rgb = color.gray2rgb(frame)
+
+    height, width = frame.shape
+
+    for _, row in df.iterrows():
+        rr, cc = draw.circle_perimeter(int(row.y), int(row.x), 5)
+        valid = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+        rr, cc = rr[valid], cc[valid]
+        rgb[rr, cc] = color_dict[row.particle]
+
+    return rgb
+
+
+def __synthetic_data(
+    n_frames: int, n_particles: int, seed: int = 874
+) -> tuple[np.ndarray, pd.DataFrame, dict]:
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 256, size=(n_frames, 712, 712), dtype=np.uint8)
+
+    df = pd.DataFrame(
+        {
+            "frame": np.repeat(np.arange(n_frames), n_particles),
+            "particle": np.tile(np.arange(n_particles), n_frames),
+            "y": rng.uniform(-3, 715, n_frames * n_particles),
+            "x": rng.uniform(-3, 715, n_frames * n_particles),
+        }
+    )
+    color_dict = {
+        particle: tuple(rng.integers(0, 256, 3)) for particle in range(n_particles)
+    }
+
+    return frames, df, color_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--particles", type=int, default=200)
+    args = parser.parse_args()
+
+    frames, df, color_dict = __synthetic_data(args.frames, args.particles)
+
+    start = time.perf_counter()
+    expected = np.stack(
+        [
+            __draw_detection_overlay(df[df.frame == t], frames[t], color_dict)
+            for t in range(frames.shape[0])
+        ]
+    )
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    colors = np.array([color_dict[p] for p in df["particle"]], dtype=np.uint8)
+    renderer = OverlayRenderer(df, colors)
+    rendered = np.concatenate(
+        [
+            renderer.render(frames[t0 : t0 + 20], t0)
+            for t0 in range(0, frames.shape[0], 20)
+        ]
+    )
+    vectorized_time = time.perf_counter() - start
+
+    assert np.array_equal(expected, rendered), "Overlays differ"
+
+    print(f"{args.frames} frames, {args.particles} features per frame")
+    print(f"Loop:       {loop_time:.2f} s")
+    print(f"Vectorized: {vectorized_time:.2f} s ({loop_time / vectorized_time:.0f}x)")
@@ -0,0 +1,139 @@
+"""
+Benchmark the segment-based particle metrics against the previous per-particle implementation on
+synthetic random walk tracks. Both implementations must produce the same particles table.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import polars as pl
+from scipy.spatial import ConvexHull
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from calculate_metrics import (  # noqa: E402
+    DIRECTION_CHANGE_THRESHOLD,
+    FRAME_INTERVAL_REGULAR,
+    PIXEL_SIZE,
+    _particle_metrics,
+)
+
+
+def __get_particle_data_row(particle_id: int, df: pl.DataFrame) -> dict:
+    particle_df = df.filter(pl.col("particle") == particle_id)
+
+    frame_interval = particle_df.select(pl.col("frame_interval"))[0].item()
+    first_frame = particle_df.select(pl.col("frame")).min()
+    last_frame = particle_df.select(pl.col("frame")).max()
+    total_time = (last_frame.item() - first_frame.item()) * frame_interval
+    displacement = particle_df.select(pl.col("displacement_(um)")).sum().item()
+    speed = (displacement / total_time) if total_time != 0 else np.nan
+
+    start_coords = particle_df.filter(pl.col("frame") == first_frame).select(["x", "y"])
+    end_coords = particle_df.filter(pl.col("frame") == last_frame).select(["x", "y"])
+    start_x, start_y = start_coords["x"][0], start_coords["y"][0]
+    end_x, end_y = end_coords["x"][0], end_coords["y"][0]
+    net_displacement = (
+        (start_x - end_x) ** 2 + (start_y - end_y) ** 2
+    ) ** 0.5 * PIXEL_SIZE
+
+    hull = ConvexHull(particle_df.select(["x", "y"]).to_numpy())
+    area = hull.volume * PIXEL_SIZE**2
+
+    coordinates = particle_df.select(["x", "y"]).to_numpy()
+    directions = np.diff(coordinates, axis=0)
+    angles = np.arctan2(directions[1:, 1], directions[1:, 0]) - np.arctan2(
+        directions[:-1, 1], directions[:-1, 0]
+    )
+    angles = np.degrees(angles) % 360
+    direction_changes = np.sum(np.abs(angles) > DIRECTION_CHANGE_THRESHOLD)
+
+    return {
+        "particle_id": particle_id,
+        "net_displacement_(um)": net_displacement,
+        "total_displacement_(um)": displacement,
+        "average_speed_(um/s)": speed,
+        "total_time_(s)": total_time,
+        "curvilinear_velocity_(um/s)": speed,
+        "straight_line_velocity_(um/s)": (net_displacement / total_time)
+        if total_time != 0
+        else np.nan,
+        "directionality_ratio": (net_displacement / displacement)
+        if displacement != 0
+        else np.nan,
+        "equivalent_diameter_(um)": 2 * np.sqrt(area / np.pi),
+        "direction_change_frequency_(Hz)": direction_changes
+        / (frame_interval * (len(coordinates) - 1)),
+    }
+
+
+def __synthetic_tracks(
+    n_particles: int, n_frames: int, seed: int = 874
+) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(30, n_frames, n_particles)
+    particle = np.repeat(np.arange(n_particles), lengths)
+    frame = np.concatenate([rng.integers(0, n_frames) + np.arange(n) for n in lengths])
+    steps = rng.normal(0, 2, (len(particle), 2))
+
+    df = pl.DataFrame(
+        {
+            "particle": particle,
+            "frame": frame,
+            "x": steps[:, 0],
+            "y": steps[:, 1],
+            "frame_interval": FRAME_INTERVAL_REGULAR,
+        }
+    )
+    df = df.with_columns(
+        pl.col("x").cum_sum().over("particle"), pl.col("y").cum_sum().over("particle")
+    )
+
+    return df.with_columns(
+        (
+            (
+                (pl.col("x") - pl.col("x").shift(1)).pow(2)
+                + (pl.col("y") - pl.col("y").shift(1)).pow(2)
+            ).sqrt()
+            * PIXEL_SIZE
+        )
+        .over("particle")
+        .alias("displacement_(um)")
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--particles", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    df = __synthetic_tracks(args.particles, args.frames)
+
+    start = time.perf_counter()
+    particle_ids = df["particle"].unique().sort().to_list()
+    expected = pl.DataFrame(
+        [__get_particle_data_row(particle_id, df) for particle_id in particle_ids]
+    )
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    particles = _particle_metrics(df)
+    vectorized_time = time.perf_counter() - start
+
+    assert expected.columns == particles.columns, "Columns differ"
+    assert np.array_equal(expected["particle_id"], particles["particle_id"])
+    for column in expected.columns[1:]:
+        np.testing.assert_allclose(
+            particles[column].to_numpy(),
+            expected[column].to_numpy(),
+            rtol=1e-9,
+            err_msg=column,
+        )
+
+    print(f"{args.particles} particles, {len(df)} track rows")
+    print(f"Per particle: {loop_time:.2f} s")
+    print(f"Vectorized:   {vectorized_time:.2f} s ({loop_time / vectorized_time:.0f}x)")
@@ -6,13 +6,20 @@ import re
 import numpy as np
 import polars as pl
 import trackpy as tp
-from scipy.spatial import ConvexHull
+
+from convex_hull import hull_areas
+from msd import emsd, ensemble_table, imsd, individual_table, msd_table
+from stage_cache import run_cached
+from tables import TABLE_FORMATS, read_polars_table, table_path, write_table
 
 PIXEL_SIZE = 1.473175577212496
 FRAME_INTERVAL_REGULAR = 0.02729  # 36.6 fps
 FRAME_INTERVAL_LOW_LIGHT = 0.11237  # 8.9 fps
 DIRECTION_CHANGE_THRESHOLD = 25
 LIGHT_INTENSITY_CODES = {"0": 95, "1": 90, "2": 85, "3": 78, "4": 64, "5": 4}
+MAX_LAGTIME = 450
+MSD_ENGINES = ["fft", "trackpy"]
+MSD_FORMATS = ["csv", "parquet"]
 
 
 def __classify_sample(replicate: str, sample: str) -> dict:
@@ -107,124 +114,74 @@ def __calculate_speeds(df: pl.DataFrame) -> pl.DataFrame:
     return df
 
 
-def __calculate_average_speed(particle_df: pl.DataFrame) -> dict:
-    frame_interval = particle_df.select(pl.col("frame_interval"))[0].item()
-    first_frame = particle_df.select(pl.col("frame")).min()
-    last_frame = particle_df.select(pl.col("frame")).max()
-    total_time = (last_frame.item() - first_frame.item()) * frame_interval
-
-    displacement = particle_df.select(pl.col("displacement_(um)")).sum().item()
-    average_speed = (displacement / total_time) if total_time != 0 else np.nan
-
-    return {"total_displacement": displacement, "average_speed": average_speed}
-
-
-def __calculate_curvilinear_velocity(particle_df: pl.DataFrame) -> dict:
-    displacement = particle_df.select(pl.col("displacement_(um)")).sum().item()
-    frame_interval = particle_df.select(pl.col("frame_interval"))[0].item()
-    first_frame = particle_df.select(pl.col("frame")).min()
-    last_frame = particle_df.select(pl.col("frame")).max()
-    total_time = (last_frame.item() - first_frame.item()) * frame_interval
-    curvilinear_velocity = (displacement / total_time) if total_time != 0 else np.nan
-
-    return {
-        "total_time": total_time,
-        "curvilinear_velocity": curvilinear_velocity,
-    }
-
-
-def __calculate_directionality_ratio(particle_df: pl.DataFrame) -> dict:
-    first_frame = particle_df.select(pl.col("frame")).min()
-    last_frame = particle_df.select(pl.col("frame")).max()
-
-    start_coords = particle_df.filter(pl.col("frame") == first_frame).select(["x", "y"])
-    end_coords = particle_df.filter(pl.col("frame") == last_frame).select(["x", "y"])
-
-    start_x, start_y = start_coords["x"][0], start_coords["y"][0]
-    end_x, end_y = end_coords["x"][0], end_coords["y"][0]
-
+def _particle_metrics(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Per-particle metrics of the track table in one pass over its rows sorted by particle and
+    frame, every particle is a contiguous segment of the sorted arrays.
+    """
+    df = df.sort(["particle", "frame"])
+    particle = df["particle"].to_numpy()
+    frame = df["frame"].to_numpy()
+    x = df["x"].cast(pl.Float64).to_numpy()
+    y = df["y"].cast(pl.Float64).to_numpy()
+    displacement = df["displacement_(um)"].cast(pl.Float64).fill_null(0).to_numpy()
+
+    starts = np.flatnonzero(np.r_[True, particle[1:] != particle[:-1]])[: len(df)]
+    ends = np.r_[starts[1:], len(df)] - 1
+    counts = ends - starts + 1
+    segment = np.repeat(np.arange(len(starts)), counts)
+    frame_interval = df["frame_interval"].cast(pl.Float64).to_numpy()[starts]
+
+    total_time = (frame[ends] - frame[starts]) * frame_interval
+    total_displacement = np.bincount(
+        segment, weights=displacement, minlength=len(starts)
+    )
     net_displacement = (
-        (start_x - end_x) ** 2 + (start_y - end_y) ** 2
+        (x[starts] - x[ends]) ** 2 + (y[starts] - y[ends]) ** 2
     ) ** 0.5 * PIXEL_SIZE
 
-    total_displacement = particle_df.select(pl.col("displacement_(um)")).sum().item()
-
-    return {
-        "net_displacement": net_displacement,
-        "total_displacement": total_displacement,
-        "directionality_ratio": (net_displacement / total_displacement)
-        if total_displacement != 0
-        else np.nan,
-    }
-
-
-def __calculate_straight_line_velocity(particle_df: pl.DataFrame) -> float:
-    frame_interval = particle_df.select(pl.col("frame_interval"))[0].item()
-    first_frame = particle_df.select(pl.col("frame")).min()
-    last_frame = particle_df.select(pl.col("frame")).max()
-    start_coords = particle_df.filter(pl.col("frame") == first_frame).select(["x", "y"])
-    end_coords = particle_df.filter(pl.col("frame") == last_frame).select(["x", "y"])
-
-    start_x, start_y = start_coords["x"][0], start_coords["y"][0]
-    end_x, end_y = end_coords["x"][0], end_coords["y"][0]
+    # Turning angle k lies between the steps out of rows k and k + 1
+    heading = np.arctan2(np.diff(y), np.diff(x))
+    turns = np.degrees(np.diff(heading)) % 360
+    changes = (turns > DIRECTION_CHANGE_THRESHOLD) & (particle[2:] == particle[:-2])
+    direction_changes = np.bincount(segment[:-2][changes], minlength=len(starts))
 
-    distance = ((start_x - end_x) ** 2 + (start_y - end_y) ** 2) ** 0.5 * PIXEL_SIZE
-    total_time = (last_frame.item() - first_frame.item()) * frame_interval
+    _, areas = hull_areas(particle, x, y)
 
-    return (distance / total_time) if total_time != 0 else np.nan
-
-
-def __calculate_direction_change_frequency(particle_df: pl.DataFrame) -> float:
-    coordinates = particle_df.select(["x", "y"]).to_numpy()
-    directions = np.diff(coordinates, axis=0)
-    angles = np.arctan2(directions[1:, 1], directions[1:, 0]) - np.arctan2(
-        directions[:-1, 1], directions[:-1, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(total_time != 0, total_displacement / total_time, np.nan)
+        straight_line_velocity = np.where(
+            total_time != 0, net_displacement / total_time, np.nan
+        )
+        directionality_ratio = np.where(
+            total_displacement != 0, net_displacement / total_displacement, np.nan
+        )
+        direction_change_frequency = direction_changes / (frame_interval * (counts - 1))
+
+    return pl.DataFrame(
+        {
+            "particle_id": particle[starts],
+            "net_displacement_(um)": net_displacement,
+            "total_displacement_(um)": total_displacement,
+            "average_speed_(um/s)": speed,
+            "total_time_(s)": total_time,
+            "curvilinear_velocity_(um/s)": speed,
+            "straight_line_velocity_(um/s)": straight_line_velocity,
+            "directionality_ratio": directionality_ratio,
+            "equivalent_diameter_(um)": 2 * np.sqrt(areas * PIXEL_SIZE**2 / np.pi),
+            "direction_change_frequency_(Hz)": direction_change_frequency,
+        }
     )
 
-    angles = np.degrees(angles) % 360
-    direction_changes = np.sum(np.abs(angles) > DIRECTION_CHANGE_THRESHOLD)
-    frame_interval = particle_df.select(pl.col("frame_interval"))[0].item()
-    total_time = frame_interval * (len(coordinates) - 1)
-    direction_change_frequency = direction_changes / total_time
-
-    return direction_change_frequency
-
-
-def __calculate_equivalent_diameter(particle_df: pl.DataFrame) -> float:
-    points = particle_df.select(["x", "y"])
-    hull = ConvexHull(points.to_numpy())
-    area = hull.volume * PIXEL_SIZE**2
-
-    return 2 * np.sqrt(area / np.pi)
-
-
-def __get_particle_data_row(particle_id: int, df: pl.DataFrame) -> dict:
-    particle_df = df.filter(pl.col("particle") == particle_id)
-
-    speed = __calculate_average_speed(particle_df)
-    curvilinear_velocity = __calculate_curvilinear_velocity(particle_df)
-    directionality_ratio = __calculate_directionality_ratio(particle_df)
-    straight_line_velocity = __calculate_straight_line_velocity(particle_df)
-    equivalent_diameter = __calculate_equivalent_diameter(particle_df)
-    direction_change_frequency = __calculate_direction_change_frequency(particle_df)
-
-    return {
-        "particle_id": particle_id,
-        "net_displacement_(um)": directionality_ratio["net_displacement"],
-        "total_displacement_(um)": speed["total_displacement"],
-        "average_speed_(um/s)": speed["average_speed"],
-        "total_time_(s)": curvilinear_velocity["total_time"],
-        "curvilinear_velocity_(um/s)": curvilinear_velocity["curvilinear_velocity"],
-        "straight_line_velocity_(um/s)": straight_line_velocity,
-        "directionality_ratio": directionality_ratio["directionality_ratio"],
-        "equivalent_diameter_(um)": equivalent_diameter,
-        "direction_change_frequency_(Hz)": direction_change_frequency,
-    }
-
-
-def _calculate_additional_tracking_data(replicate: str, sample: str):
-    df = pl.read_csv("linking.csv")
 
+def _calculate_additional_tracking_data(
+    df: pl.DataFrame,
+    replicate: str,
+    sample: str,
+    msd_engine: str = "fft",
+    msd_format: str = "csv",
+    table_format: str = "csv",
+) -> pl.DataFrame | None:
     if "Unnamed: 0" in df.columns:
         df = df.drop("Unnamed: 0")
 
@@ -257,15 +214,30 @@ def _calculate_additional_tracking_data(replicate: str, sample: str):
             }
         )
         df.write_csv("tracks.csv")
-        return
+        return None
 
     fps = 1 / (df["frame_interval"][0])
-    df_pandas = df.to_pandas()
-    im = tp.imsd(df_pandas, mpp=PIXEL_SIZE, fps=fps, max_lagtime=450)
-    im.to_csv("imsd.csv")
-
-    em = tp.emsd(df_pandas, mpp=PIXEL_SIZE, fps=fps, max_lagtime=450)
-    em.to_csv("emsd.csv")
+    if msd_engine == "fft":
+        table = msd_table(
+            df["particle"].to_numpy(),
+            df["frame"].to_numpy(),
+            df["x"].to_numpy(),
+            df["y"].to_numpy(),
+            PIXEL_SIZE,
+            MAX_LAGTIME,
+        )
+        if msd_format == "parquet":
+            individual_table(table, fps).to_parquet("imsd.parquet", index=False)
+            ensemble_table(table, fps).to_parquet("emsd.parquet", index=False)
+        else:
+            imsd(table, fps).to_csv("imsd.csv")
+            emsd(table, fps).to_csv("emsd.csv")
+    else:
+        df_pandas = df.to_pandas()
+        im = tp.imsd(df_pandas, mpp=PIXEL_SIZE, fps=fps, max_lagtime=MAX_LAGTIME)
+        em = tp.emsd(df_pandas, mpp=PIXEL_SIZE, fps=fps, max_lagtime=MAX_LAGTIME)
+        im.to_csv("imsd.csv")
+        em.to_csv("emsd.csv")
 
     # write additional tracking data
     df = df.select(
@@ -289,21 +261,35 @@ def _calculate_additional_tracking_data(replicate: str, sample: str):
         ]
     )
 
-    df.write_csv("additional-tracking-data.csv")
-
+    write_table(df, table_path("additional-tracking-data", table_format))
 
-def _calculate_final_particle_tracking_data():
-    df = pl.read_csv("additional-tracking-data.csv")
-    particle_ids = (
-        df.select(pl.col("particle")).unique().sort("particle").to_series().to_list()
-    )
+    return df
 
-    particle_data = []
-    for particle_id in particle_ids:
-        particle_data.append(__get_particle_data_row(particle_id, df))
 
-    particles_df = pl.DataFrame(particle_data)
-    particles_df.write_csv("particles.csv")
+def _calculate_final_particle_tracking_data(
+    df: pl.DataFrame, table_format: str = "csv", export_csv: bool = False
+):
+    particles_df = _particle_metrics(df)
+    write_table(particles_df, table_path("particles", table_format))
+    if export_csv and table_format != "csv":
+        particles_df.write_csv("particles.csv")
+
+
+def _metrics_stage(
+    df: pl.DataFrame,
+    replicate: str,
+    sample: str,
+    msd_engine: str = "fft",
+    msd_format: str = "csv",
+    table_format: str = "csv",
+    export_csv: bool = False,
+):
+    """Write the tracking data, MSD and particles tables of a linking table."""
+    df = _calculate_additional_tracking_data(
+        df, replicate, sample, msd_engine, msd_format, table_format
+    )
+    if df is not None:
+        _calculate_final_particle_tracking_data(df, table_format, export_csv)
 
 
 if __name__ == "__main__":
@@ -314,9 +300,87 @@ if __name__ == "__main__":
     )
     parser.add_argument("--sample-name", type=str, required=True, help="Sample name")
     parser.add_argument(
-        "--linking-csv", type=str, required=True, help="Path to linking csv file"
+        "--linking-csv",
+        "--linking-table",
+        dest="linking_table",
+        type=str,
+        required=True,
+        help="Path to linking table, csv or parquet",
+    )
+    parser.add_argument(
+        "--msd-engine",
+        type=str,
+        choices=MSD_ENGINES,
+        default="fft",
+        help="Compute MSD with the gap-aware FFT algorithm or with trackpy",
+    )
+    parser.add_argument(
+        "--msd-format",
+        type=str,
+        choices=MSD_FORMATS,
+        default="csv",
+        help="Write MSD as wide csv tables or as long Parquet tables with one row per "
+        "particle and lag",
+    )
+    parser.add_argument(
+        "--table-format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="csv",
+        help="Format of the tracking data and particles tables",
+    )
+    parser.add_argument(
+        "--export-csv",
+        action="store_true",
+        help="Also write particles.csv when tables are written as parquet",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Reuse outputs of earlier runs with the same inputs and parameters",
     )
     args = parser.parse_args()
 
-    _calculate_additional_tracking_data(args.replicate_name, args.sample_name)
-    _calculate_final_particle_tracking_data()
+    if args.msd_format == "parquet" and args.msd_engine != "fft":
+        parser.error("--msd-format parquet requires --msd-engine fft")
+
+    msd_extension = "parquet" if args.msd_format == "parquet" else "csv"
+    outputs = [
+        table_path("additional-tracking-data", args.table_format),
+        table_path("particles", args.table_format),
+        f"imsd.{msd_extension}",
+        f"emsd.{msd_extension}",
+    ]
+    if args.export_csv and args.table_format != "csv":
+        outputs.append("particles.csv")
+
+    run_cached(
+        args.cache_dir,
+        "metrics",
+        [args.linking_table],
+        {
+            "pixel_size": PIXEL_SIZE,
+            "frame_interval_regular": FRAME_INTERVAL_REGULAR,
+            "frame_interval_low_light": FRAME_INTERVAL_LOW_LIGHT,
+            "direction_change_threshold": DIRECTION_CHANGE_THRESHOLD,
+            "light_intensity_codes": LIGHT_INTENSITY_CODES,
+            "max_lagtime": MAX_LAGTIME,
+            "replicate": args.replicate_name,
+            "sample": args.sample_name,
+            "msd_engine": args.msd_engine,
+            "msd_format": args.msd_format,
+            "table_format": args.table_format,
+        },
+        __file__,
+        outputs,
+        lambda: _metrics_stage(
+            read_polars_table(args.linking_table),
+            args.replicate_name,
+            args.sample_name,
+            args.msd_engine,
+            args.msd_format,
+            args.table_format,
+            args.export_csv,
+        ),
+    )
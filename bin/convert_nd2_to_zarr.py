@@ -2,38 +2,114 @@
 
 
 import argparse
+import resource
+import time
 
 import dask.array as da
 import nd2
-import zarr
+import numpy as np
+
+from zarr_io import SHARD_SHAPE, create_array, shard_blocks, write_blocks
+
+
+def __frames_per_block(frame_nbytes: int, max_memory_mb: int, workers: int) -> int:
+    # Every block in flight is held twice: once as read from the ND2
+    # (all channels) and once as the encoded shard buffers. One more
+    # block is being read while the workers are busy.
+    shard_nbytes = 2 * SHARD_SHAPE[0] * frame_nbytes * (workers + 1)
+    shards = (max_memory_mb * 1024**2) // shard_nbytes
+    if shards == 0:
+        raise ValueError(
+            f"--max-memory-mb {max_memory_mb} is below the "
+            f"{-(-shard_nbytes // 1024**2)} MB needed for one shard per block "
+            f"with {workers} workers"
+        )
+
+    return int(shards * SHARD_SHAPE[0])
+
+
+def __stream_to_zarr(
+    img_da: da.Array,
+    array,
+    source_frame_nbytes: int,
+    max_memory_mb: int,
+    workers: int = 1,
+) -> dict:
+    n_frames = img_da.shape[0]
+    block_frames = __frames_per_block(source_frame_nbytes, max_memory_mb, workers)
+
+    # Reading from the ND2 stays on this thread, the workers only encode
+    # and write shards.
+    blocks = (
+        (block.start, img_da[block].compute(scheduler="synchronous"))
+        for block in shard_blocks(n_frames, block_frames)
+    )
+
+    start = time.perf_counter()
+    written = write_blocks(array, blocks, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "frames": n_frames,
+        "block_frames": block_frames,
+        "written_mb": written / 1024**2,
+        "elapsed_s": elapsed,
+    }
+
+
+def __print_conversion_report(stats: dict) -> None:
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    throughput = stats["written_mb"] / stats["elapsed_s"] if stats["elapsed_s"] else 0
+
+    print(
+        f"Converted {stats['frames']} frames in blocks of {stats['block_frames']} "
+        f"({stats['written_mb']:.1f} MB in {stats['elapsed_s']:.1f} s, "
+        f"{throughput:.1f} MB/s, peak memory {peak_mb:.0f} MB)"
+    )
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert ND2 files to Zarr format")
     parser.add_argument("--nd2-path", type=str, help="Path to ND2 file")
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read and write the movie shard by shard with bounded memory "
+        "(implied by --workers > 1)",
+    )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=int,
+        default=1024,
+        help="Memory ceiling for frame blocks in streaming mode",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of shard writer threads"
+    )
 
     args = parser.parse_args()
 
     with nd2.ND2File(args.nd2_path) as f:
         img_da = f.to_dask()
+        source_frame_nbytes = int(np.prod(img_da.shape[1:])) * img_da.dtype.itemsize
+
+        # Slicing stays lazy, so only the frames of the block being computed
+        # are read from the ND2 and the other channels are dropped right away.
         img_da = da.moveaxis(img_da, -1, 1)
         img_da = img_da[:, 2, :, :]
 
-        zarr_path = "raw-data.zarr"
-
-        array = zarr.create_array(
-            store=zarr_path,
-            shape=img_da.shape,
-            dtype=img_da.dtype,
-            chunks=(1, 356, 356),
-            shards=(20, 712, 712),
-            compressors=zarr.codecs.BloscCodec(
-                cname="zstd", clevel=5, shuffle=zarr.codecs.BloscShuffle.shuffle
-            ),
-            zarr_format=3,
-            dimension_names=["t", "y", "x"],
+        array = create_array(
+            "raw-data.zarr", img_da.shape, img_da.dtype, dimension_names=["t", "y", "x"]
         )
 
-        array[:] = img_da
+        if args.streaming or args.workers > 1:
+            stats = __stream_to_zarr(
+                img_da, array, source_frame_nbytes, args.max_memory_mb, args.workers
+            )
+            __print_conversion_report(stats)
+        else:
+            array[:] = img_da
 
         voxel_size = f.voxel_size()
         metadata = f.metadata.channels[0].microscope
@@ -0,0 +1,95 @@
+"""
+Convex hull areas of many point sets in one call. Points are sorted once by set, x and y, and the
+hull of every set is computed with a Numba-compiled monotone chain over its segment of the sorted
+arrays.
+"""
+
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True)
+def __cross(ox, oy, ax, ay, bx, by):
+    return (ax - ox) * (by - oy) - (ay - oy) * (bx - ox)
+
+
+@numba.njit(cache=True)
+def __segment_hull_areas(x, y, offsets):
+    areas = np.zeros(len(offsets) - 1)
+    hull_x = np.empty(2 * len(x) + 1)
+    hull_y = np.empty(2 * len(y) + 1)
+
+    for segment in range(len(offsets) - 1):
+        start, stop = offsets[segment], offsets[segment + 1]
+        if stop - start < 3:
+            continue
+
+        # Lower hull
+        k = 0
+        for i in range(start, stop):
+            while (
+                k >= 2
+                and __cross(
+                    hull_x[k - 2],
+                    hull_y[k - 2],
+                    hull_x[k - 1],
+                    hull_y[k - 1],
+                    x[i],
+                    y[i],
+                )
+                <= 0
+            ):
+                k -= 1
+            hull_x[k] = x[i]
+            hull_y[k] = y[i]
+            k += 1
+
+        # Upper hull
+        lower_size = k + 1
+        for i in range(stop - 2, start - 1, -1):
+            while (
+                k >= lower_size
+                and __cross(
+                    hull_x[k - 2],
+                    hull_y[k - 2],
+                    hull_x[k - 1],
+                    hull_y[k - 1],
+                    x[i],
+                    y[i],
+                )
+                <= 0
+            ):
+                k -= 1
+            hull_x[k] = x[i]
+            hull_y[k] = y[i]
+            k += 1
+
+        # Shoelace formula, the last hull point repeats the first one
+        area = 0.0
+        for j in range(k - 1):
+            area += hull_x[j] * hull_y[j + 1] - hull_x[j + 1] * hull_y[j]
+        areas[segment] = abs(area) / 2
+
+    return areas
+
+
+def hull_areas(
+    labels: np.ndarray, x: np.ndarray, y: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Area of the convex hull of the points of every label. Returns the unique labels and their
+    areas, sets with fewer than three points or collinear points have zero area.
+    """
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return labels, np.zeros(0)
+
+    order = np.lexsort((y, x, labels))
+    labels = labels[order]
+    x = np.asarray(x, dtype=np.float64)[order]
+    y = np.asarray(y, dtype=np.float64)[order]
+
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    offsets = np.r_[starts, len(labels)].astype(np.int64)
+
+    return labels[starts], __segment_hull_areas(x, y, offsets)
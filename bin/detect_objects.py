@@ -1,30 +1,164 @@
 #! /usr/bin/env python
 
 import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 import dask.array as da
 import numpy as np
 import pandas as pd
 import trackpy as tp
-import zarr
-import zarr.codecs
-from skimage import color, draw
+
+from mask_io import open_mask
+from overlay import OVERLAY_MODES, OverlayRenderer
+from stage_cache import run_cached
+from tables import TABLE_FORMATS, TableWriter, table_path, write_table
+from zarr_io import create_array, shard_blocks, write_blocks
+
+LOCATE_PARAMETERS = {"diameter": 5, "minmass": 40, "separation": 3}
 
 tp.quiet()
 
 
-def __draw_detection_overlay(df: pd.DataFrame, frame: np.ndarray) -> np.ndarray:
-    rgb = color.gray2rgb(frame)
+def __locate(frames: np.ndarray, first_frame: int = 0) -> pd.DataFrame:
+    f = tp.batch(frames, **LOCATE_PARAMETERS)
+    f["frame"] += first_frame
+
+    return f
+
+
+def __locate_memmap(frames_path: str, start: int, stop: int) -> pd.DataFrame:
+    frames = np.load(frames_path, mmap_mode="r")
+
+    return __locate(np.asarray(frames[start:stop]), start)
+
+
+def __locate_parallel(
+    frames: np.ndarray, processes: int, first_frame: int = 0
+) -> pd.DataFrame:
+    if processes <= 1:
+        return __locate(frames, first_frame)
+
+    # Workers read their frames from a memory-mapped copy of the stack
+    # instead of receiving pickled arrays. Several tasks per process even
+    # out frames with many and few features.
+    n_frames = frames.shape[0]
+    step = max(1, -(-n_frames // (processes * 4)))
+    with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+        frames_path = f"{tmp_dir}/frames.npy"
+        np.save(frames_path, frames)
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [
+                pool.submit(__locate_memmap, frames_path, t0, min(t0 + step, n_frames))
+                for t0 in range(0, n_frames, step)
+            ]
+            # Results are collected in submission order, i.e. frame order
+            parts = [future.result() for future in futures]
+
+    # Frames without features return untyped empty tables, which would
+    # change the column dtypes of the merged table
+    parts = [part for part in parts if len(part) > 0] or parts[:1]
+    f = pd.concat(parts, ignore_index=True)
+    f["frame"] += first_frame
+
+    return f
+
 
-    height, width = frame.shape
+def __streaming_mean(raw_da: da.Array, block_frames: int) -> float:
+    # Exact integer sum, one shard block in memory at a time
+    total = 0
+    for block in shard_blocks(raw_da.shape[0], block_frames):
+        total += int(raw_da[block].compute().sum(dtype=np.uint64))
 
-    for _, row in df.iterrows():
-        rr, cc = draw.circle_perimeter(int(row.y), int(row.x), 5)
-        valid = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
-        rr, cc = rr[valid], cc[valid]
-        rgb[rr, cc] = [0, 255, 0]
+    return total / raw_da.size
 
-    return rgb
+
+def _detection_stage(
+    frames: np.ndarray,
+    exclude: np.ndarray,
+    processes: int = 1,
+    workers: int = 1,
+    overlay_mode: str = "zarr",
+    table_format: str = "csv",
+) -> pd.DataFrame:
+    """
+    Detect objects in a movie in memory and write the detection table and overlay. Exclusion
+    areas are filled in place for detection and restored afterwards.
+    """
+    # Fill exclusion areas using mean intensity
+    # of the entire time series
+    mean_intensity = frames.mean()
+    excluded = frames[exclude]
+    frames[exclude] = mean_intensity
+
+    try:
+        f = __locate_parallel(frames, processes)
+        write_table(f, table_path("detection", table_format), index=False)
+
+        # save detection overlay
+        if overlay_mode == "zarr":
+            array = create_array(
+                "detection.zarr",
+                frames.shape + (3,),
+                frames.dtype,
+                dimension_names=["t", "y", "x", "c"],
+            )
+            renderer = OverlayRenderer(f)
+
+            def __overlay_blocks():
+                for block in shard_blocks(frames.shape[0]):
+                    yield block.start, renderer.render(frames[block], block.start)
+
+            write_blocks(array, __overlay_blocks(), workers=workers)
+    finally:
+        frames[exclude] = excluded
+
+    return f
+
+
+def _streaming_detection_stage(
+    raw_da: da.Array,
+    exclude: da.Array,
+    block_frames: int = 20,
+    processes: int = 1,
+    workers: int = 1,
+    overlay_mode: str = "zarr",
+    table_format: str = "csv",
+) -> None:
+    """Detect objects block by block and write the detection table and overlay."""
+    if overlay_mode == "zarr":
+        array = create_array(
+            "detection.zarr",
+            raw_da.shape + (3,),
+            raw_da.dtype,
+            dimension_names=["t", "y", "x", "c"],
+        )
+
+    # Fill exclusion areas using mean intensity
+    # of the entire time series, computed in a first pass
+    mean_intensity = __streaming_mean(raw_da, block_frames)
+
+    def __detection_blocks(writer: TableWriter):
+        for block in shard_blocks(raw_da.shape[0], block_frames):
+            frames = raw_da[block].compute()
+            frames[exclude[block].compute()] = mean_intensity
+
+            f = __locate_parallel(frames, processes, block.start)
+            writer.append(f)
+
+            yield block.start, frames, f
+
+    with TableWriter(table_path("detection", table_format)) as writer:
+        if overlay_mode == "zarr":
+            overlay_blocks = (
+                (t0, OverlayRenderer(f).render(frames, t0))
+                for t0, frames, f in __detection_blocks(writer)
+            )
+            write_blocks(array, overlay_blocks, workers=workers)
+        else:
+            for _ in __detection_blocks(writer):
+                pass
 
 
 if __name__ == "__main__":
@@ -34,11 +168,53 @@ if __name__ == "__main__":
     parser.add_argument(
         "--large-objects-zarr", type=str, help="Path to large objects zarr"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of shard writer threads"
+    )
+    parser.add_argument(
+        "--overlay-mode",
+        type=str,
+        choices=OVERLAY_MODES,
+        default="zarr",
+        help="Write detection.zarr (zarr), or only the features table for overlays "
+        "rendered on demand (lazy)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes locating features",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Detect objects block by block instead of loading the whole movie",
+    )
+    parser.add_argument(
+        "--block-frames",
+        type=int,
+        default=20,
+        help="Frames per block in streaming mode, a multiple of the shard length",
+    )
+    parser.add_argument(
+        "--table-format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="csv",
+        help="Format of the detection table",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Reuse outputs of earlier runs with the same inputs and parameters",
+    )
 
     args = parser.parse_args()
 
     raw_data_zarr_path = args.raw_data_zarr
     large_objects_zarr_path = args.large_objects_zarr
+    detection_path = table_path("detection", args.table_format)
 
     raw_da = da.from_zarr(raw_data_zarr_path)
     assert raw_da.ndim == 3, "Expected 2D time-series data"
@@ -46,40 +222,40 @@ if __name__ == "__main__":
     assert raw_da.shape[2] == 712
     assert raw_da.dtype == "uint8"
 
-    exclude_large_objects = da.from_zarr(large_objects_zarr_path)
+    exclude_large_objects = open_mask(large_objects_zarr_path)
 
-    frames = raw_da[:, :, :].compute()
-    exclude = exclude_large_objects
+    def __detect():
+        if args.streaming:
+            _streaming_detection_stage(
+                raw_da,
+                exclude_large_objects,
+                args.block_frames,
+                args.processes,
+                args.workers,
+                args.overlay_mode,
+                args.table_format,
+            )
+        else:
+            _detection_stage(
+                raw_da[:, :, :].compute(),
+                exclude_large_objects.compute(),
+                args.processes,
+                args.workers,
+                args.overlay_mode,
+                args.table_format,
+            )
 
-    # Fill exclusion areas using mean intensity
-    # of the entire time series
-    mean_intensity = frames.mean()
-    frames[exclude] = mean_intensity
-
-    f = tp.batch(frames, diameter=5, minmass=40, separation=3)
-    f.to_csv("detection.csv", index=False)
-
-    # save detection overlay
-    detection_overlays = []
-
-    for t in range(frames.shape[0]):
-        overlay = __draw_detection_overlay(f[f.frame == t], frames[t])
-        detection_overlays.append(da.from_array(overlay))
-
-    detection_da = da.stack(detection_overlays)
-    detection_da = detection_da.rechunk()
-
-    array = zarr.create_array(
-        store="detection.zarr",
-        shape=detection_da.shape,
-        dtype=detection_da.dtype,
-        chunks=(1, 356, 356, 3),
-        shards=(20, 712, 712, 3),
-        compressors=zarr.codecs.BloscCodec(
-            cname="zstd", clevel=5, shuffle=zarr.codecs.BloscShuffle.shuffle
-        ),
-        zarr_format=3,
-        dimension_names=["t", "y", "x", "c"],
+    run_cached(
+        args.cache_dir,
+        "detection",
+        [raw_data_zarr_path, large_objects_zarr_path],
+        {
+            **LOCATE_PARAMETERS,
+            "streaming": args.streaming,
+            "overlay_mode": args.overlay_mode,
+            "table_format": args.table_format,
+        },
+        __file__,
+        [detection_path] + (["detection.zarr"] if args.overlay_mode == "zarr" else []),
+        __detect,
     )
-
-    array[:] = detection_da
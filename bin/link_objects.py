@@ -6,104 +6,252 @@ import dask.array as da
 import numpy as np
 import pandas as pd
 import trackpy as tp
-import zarr
-from scipy.spatial import ConvexHull
-from skimage import color, draw
 
-np.random.seed(874)
-tp.linking.Linker.MAX_SUB_NET_SIZE = 10000
+from convex_hull import hull_areas
+from linking_profile import PROFILE_COLUMNS, print_profile_summary, profiled_link_df
+from nv_linker import NearestVelocityLinker
+from overlay import OVERLAY_MODES, OverlayRenderer, linking_colors
+from stage_cache import run_cached
+from tables import TABLE_FORMATS, read_table, table_path, write_table
+from window_linking import link_windows, validation_report
+from zarr_io import create_array, shard_blocks, write_blocks
+
+MAX_SUB_NET_SIZE = 10000
+PREDICTOR_SPAN = 20
+LINK_PARAMETERS = {
+    "search_range": 35,
+    "memory": 20,
+    "adaptive_stop": 5,
+    "adaptive_step": 0.95,
+}
+FILTER_PARAMETERS = {
+    "stub_threshold": 30,
+    "max_mass": 900,
+    "max_size": 1.8,
+    "min_area": 15**2,  # 15 pixels squared
+}
+
+tp.linking.Linker.MAX_SUB_NET_SIZE = MAX_SUB_NET_SIZE
 tp.quiet()
 
 
-def __draw_detection_overlay(
-    df: pd.DataFrame, frame: np.ndarray, color_dict: dict
-) -> np.ndarray:
-    rgb = color.gray2rgb(frame)
+def __particles_covering_area(t: pd.DataFrame, threshold: float) -> pd.Index:
+    # The convex hull lies within the bounding box, so particles whose
+    # bounding box is not larger than the threshold cannot pass.
+    groups = t.groupby("particle")
+    extent = groups[["x", "y"]].max() - groups[["x", "y"]].min()
+    candidates = extent.index[
+        (extent["x"] * extent["y"] > threshold) & (groups.size() >= 3)
+    ]
+
+    candidate_t = t[t["particle"].isin(candidates)]
+    particles, areas = hull_areas(
+        candidate_t["particle"].to_numpy(),
+        candidate_t["x"].to_numpy(),
+        candidate_t["y"].to_numpy(),
+    )
+
+    return pd.Index(particles[areas > threshold], name="particle")
+
+
+def _linking_stage(
+    f: pd.DataFrame,
+    frames: np.ndarray | da.Array | None = None,
+    workers: int = 1,
+    table_format: str = "csv",
+    linker: str = "trackpy",
+    n_windows: int = 1,
+    window_overlap: int = 2 * LINK_PARAMETERS["memory"],
+    validate_windows: bool = False,
+    profile: bool = False,
+) -> pd.DataFrame:
+    """
+    Link and filter detections and write the linking table, and the linking overlay of `frames`
+    when they are given. Lazy frames are read one shard block at a time.
+    """
+    if linker == "numba":
+        nv_linker = NearestVelocityLinker(
+            span=PREDICTOR_SPAN, max_sub_net_size=MAX_SUB_NET_SIZE, **LINK_PARAMETERS
+        )
+        t = nv_linker.link(f)
+        telemetry = pd.DataFrame(nv_linker.profile, columns=PROFILE_COLUMNS)
+    elif n_windows > 1:
+        t = link_windows(
+            f,
+            n_windows,
+            window_overlap,
+            PREDICTOR_SPAN,
+            MAX_SUB_NET_SIZE,
+            LINK_PARAMETERS,
+        )
+    elif profile:
+        t, telemetry = profiled_link_df(f, PREDICTOR_SPAN, LINK_PARAMETERS)
+    else:
+        pred = tp.predict.NearestVelocityPredict(span=PREDICTOR_SPAN)
+        t = pred.link_df(f, **LINK_PARAMETERS)
+
+    if profile:
+        telemetry.to_parquet("linking-profile.parquet", index=False)
+        print_profile_summary(telemetry)
+
+    if n_windows > 1 and validate_windows:
+        pred = tp.predict.NearestVelocityPredict(span=PREDICTOR_SPAN)
+        report = validation_report(pred.link_df(f, **LINK_PARAMETERS), t)
+        print(report.to_string())
+
+    t = tp.filter_stubs(t, threshold=FILTER_PARAMETERS["stub_threshold"])
+    t = t[t["mass"] <= FILTER_PARAMETERS["max_mass"]]
+    t = t[t["size"] <= FILTER_PARAMETERS["max_size"]]
+
+    # Filter out particles that don't cover enough area.
+    # This will remove particles that have little to no movement.
+    # This setting is important in reducing the low-level noise in the data.
+    particles_to_keep = __particles_covering_area(t, FILTER_PARAMETERS["min_area"])
+
+    t = t[t["particle"].isin(particles_to_keep)]
+    write_table(t, table_path("linking", table_format), escapechar="\\")
 
-    height, width = frame.shape
+    if frames is not None:
+        renderer = OverlayRenderer(t, linking_colors(t))
 
-    for _, row in df.iterrows():
-        rr, cc = draw.circle_perimeter(int(row.y), int(row.x), 5)
-        valid = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
-        rr, cc = rr[valid], cc[valid]
-        particle = row.particle
-        rgb[rr, cc] = color_dict[particle]
+        def __overlay_blocks():
+            for block in shard_blocks(frames.shape[0]):
+                yield block.start, renderer.render(
+                    np.asarray(frames[block]), block.start
+                )
 
-    return rgb
+        array = create_array(
+            "linking.zarr",
+            frames.shape + (3,),
+            frames.dtype,
+            dimension_names=["t", "y", "x", "c"],
+        )
+
+        write_blocks(array, __overlay_blocks(), workers=workers)
+
+    return t
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Link detected objects")
 
     parser.add_argument("--raw-data-zarr", type=str, help="Path to raw data zarr")
-    parser.add_argument("--detection-csv", type=str, help="Path to detection csv")
+    parser.add_argument(
+        "--detection-csv",
+        "--detection-table",
+        dest="detection_table",
+        type=str,
+        help="Path to detection table, csv or parquet",
+    )
+    parser.add_argument(
+        "--table-format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="csv",
+        help="Format of the linking table",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of shard writer threads"
+    )
+    parser.add_argument(
+        "--overlay-mode",
+        type=str,
+        choices=OVERLAY_MODES,
+        default="zarr",
+        help="Write linking.zarr (zarr), or only the tracks table for overlays "
+        "rendered on demand (lazy)",
+    )
+    parser.add_argument(
+        "--linker",
+        type=str,
+        choices=["trackpy", "numba"],
+        default="trackpy",
+        help="Linking engine, trackpy's NearestVelocityPredict or the compiled "
+        "greedy nearest-velocity linker",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write per-frame linking telemetry to linking-profile.parquet",
+    )
+    parser.add_argument(
+        "--link-windows",
+        type=int,
+        default=1,
+        help="Link this many overlapping time windows on separate processes",
+    )
+    parser.add_argument(
+        "--window-overlap",
+        type=int,
+        default=2 * LINK_PARAMETERS["memory"],
+        help="Frames shared by consecutive windows, at least the linking memory",
+    )
+    parser.add_argument(
+        "--validate-windows",
+        action="store_true",
+        help="Also link serially and report track statistics of both results",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Reuse outputs of earlier runs with the same inputs and parameters",
+    )
 
     args = parser.parse_args()
 
-    # root = zarr.open_group(zarr_path, mode="a")
-    f = pd.read_csv(args.detection_csv)
+    if args.window_overlap < LINK_PARAMETERS["memory"]:
+        parser.error("--window-overlap must be at least the linking memory")
+    if args.linker != "trackpy" and args.link_windows > 1:
+        parser.error("--link-windows requires --linker trackpy")
+    if args.profile and args.link_windows > 1:
+        parser.error("--profile is not available with --link-windows")
 
-    pred = tp.predict.NearestVelocityPredict(span=20)
-    t = pred.link_df(f, search_range=35, memory=20, adaptive_stop=5, adaptive_step=0.95)
-    t = tp.filter_stubs(t, threshold=30)
-    t = t[t["mass"] <= 900]
-    t = t[t["size"] <= 1.8]
+    # create linking overlay from the raw data, in lazy mode overlays
+    # are rendered on demand from the tracks table instead
+    frames = None
+    if args.overlay_mode == "zarr":
+        raw_da = da.from_zarr(args.raw_data_zarr)
+        assert raw_da.ndim == 3, "Expected 2D time-series data"
+        assert raw_da.shape[1] == 712
+        assert raw_da.shape[2] == 712
+        assert raw_da.dtype == "uint8"
 
-    groups = t.groupby("particle")
-    area_covered_df = pd.DataFrame()
-    for name, group in groups:
-        if len(group) >= 3:
-            hull = ConvexHull(group[["x", "y"]])
-            area = hull.volume
-            area_covered_df = pd.concat(
-                [area_covered_df, pd.DataFrame({"particle": [name], "area": [area]})]
-            )
+        frames = raw_da
 
-    # Filter out particles that don't cover enough area.
-    # This will remove particles that have little to no movement.
-    # This setting is important in reducing the low-level noise in the data.
-    area_covered_df.set_index("particle", inplace=True)
-    threshold = 15**2  # 15 pixels squared
-    particles_to_keep = area_covered_df[area_covered_df["area"] > threshold].index
+    outputs = [table_path("linking", args.table_format)]
+    if args.overlay_mode == "zarr":
+        outputs.append("linking.zarr")
+    if args.profile:
+        outputs.append("linking-profile.parquet")
 
-    t = t[t["particle"].isin(particles_to_keep)]
-    t.to_csv("linking.csv", escapechar="\\")
-
-    # create linking overlay
-    color_dict = {
-        particle: tuple(np.random.randint(0, 256, 3))
-        for particle in t["particle"].unique()
-    }
-
-    raw_da = da.from_zarr(args.raw_data_zarr)
-    assert raw_da.ndim == 3, "Expected 2D time-series data"
-    assert raw_da.shape[1] == 712
-    assert raw_da.shape[2] == 712
-    assert raw_da.dtype == "uint8"
-
-    frames = raw_da[:, :, :].compute()
-
-    overlay_frames = []
-    for time in range(frames.shape[0]):
-        overlay = __draw_detection_overlay(
-            t[t["frame"] == time], frames[time], color_dict
-        )
-        overlay_frames.append(da.from_array(overlay))
-
-    overlay_da = da.stack(overlay_frames)
-    overlay_da = overlay_da.rechunk()
-
-    array = zarr.create_array(
-        store="linking.zarr",
-        shape=overlay_da.shape,
-        dtype=overlay_da.dtype,
-        chunks=(1, 356, 356, 3),
-        shards=(20, 712, 712, 3),
-        compressors=zarr.codecs.BloscCodec(
-            cname="zstd", clevel=5, shuffle=zarr.codecs.BloscShuffle.shuffle
+    run_cached(
+        args.cache_dir,
+        "linking",
+        [args.detection_table] + ([args.raw_data_zarr] if frames is not None else []),
+        {
+            "predictor_span": PREDICTOR_SPAN,
+            "max_sub_net_size": MAX_SUB_NET_SIZE,
+            **LINK_PARAMETERS,
+            **FILTER_PARAMETERS,
+            "linker": args.linker,
+            "link_windows": args.link_windows,
+            "window_overlap": args.window_overlap if args.link_windows > 1 else None,
+            "overlay_mode": args.overlay_mode,
+            "table_format": args.table_format,
+            "profile": args.profile,
+        },
+        __file__,
+        outputs,
+        lambda: _linking_stage(
+            read_table(args.detection_table),
+            frames,
+            args.workers,
+            args.table_format,
+            args.linker,
+            args.link_windows,
+            args.window_overlap,
+            args.validate_windows,
+            args.profile,
         ),
-        zarr_format=3,
-        dimension_names=["t", "y", "x", "c"],
     )
-
-    array[:] = overlay_da
@@ -0,0 +1,92 @@
+"""
+Per-frame telemetry for linking. Linking with trackpy is instrumented through the predictor, which
+trackpy calls once per frame after the first with the particles it is about to link, and through
+the subnetwork linker, which trackpy calls for every subnetwork it solves. The call times give the
+time per frame, and the subnetwork linker records candidates, subnetwork sizes and the adaptive
+search retries of oversized subnetworks.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+from trackpy.linking import SubnetOversizeException
+from trackpy.linking.subnetlinker import subnet_linker_numba, subnet_linker_recursive
+from trackpy.try_numba import NUMBA_AVAILABLE
+
+PROFILE_COLUMNS = [
+    "frame",
+    "detections",
+    "active_tracks",
+    "candidates",
+    "largest_subnet",
+    "adaptive_steps",
+    "time_s",
+]
+# Subnetwork linker of trackpy's default "auto" link strategy
+SUBNET_LINKER = subnet_linker_numba if NUMBA_AVAILABLE else subnet_linker_recursive
+
+
+def profiled_link_df(
+    f: pd.DataFrame, span: int, link_parameters: dict
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    pred = tp.predict.NearestVelocityPredict(span=span)
+    predict = pred.predict
+    frames = np.sort(f["frame"].unique())
+    detections = f.groupby("frame").size()
+    rows = {
+        frame: {
+            "frame": frame,
+            "detections": detections[frame],
+            "active_tracks": 0,
+            "candidates": 0,
+            "largest_subnet": 0,
+            "adaptive_steps": 0,
+        }
+        for frame in frames
+    }
+    # Frames being linked and the times linking them started
+    starts = [(frames[0], time.perf_counter())] if len(frames) else []
+
+    def __recording_predict(t1, particles):
+        starts.append((t1, time.perf_counter()))
+        rows[t1]["active_tracks"] = len(particles)
+        return predict(t1, particles)
+
+    def __recording_subnet_linker(source_set, dest_set, search_range, **kwargs):
+        row = rows[starts[-1][0]]
+        size = len(source_set)
+        # Retries of adaptive search are called with reduced search ranges
+        # on the already counted particles
+        if search_range == link_parameters["search_range"]:
+            row["candidates"] += sum(len(sp.forward_cands) for sp in source_set)
+        try:
+            links = SUBNET_LINKER(source_set, dest_set, search_range, **kwargs)
+        except SubnetOversizeException:
+            row["adaptive_steps"] += 1
+            raise
+        row["largest_subnet"] = max(row["largest_subnet"], size)
+
+        return links
+
+    pred.predict = __recording_predict
+
+    t = pred.link_df(f, link_strategy=__recording_subnet_linker, **link_parameters)
+    end = time.perf_counter()
+
+    # Linking of a frame lasts until the predictor is called for the next one
+    for (frame, start), (_, stop) in zip(starts, starts[1:] + [(None, end)]):
+        rows[frame]["time_s"] = stop - start
+
+    return t, pd.DataFrame(list(rows.values()), columns=PROFILE_COLUMNS)
+
+
+def print_profile_summary(profile: pd.DataFrame, n_slowest: int = 5) -> None:
+    print(
+        f"Linked {len(profile)} frames in {profile['time_s'].sum():.1f} s, "
+        f"largest subnetwork {profile['largest_subnet'].max()}, "
+        f"{(profile['adaptive_steps'] > 0).sum()} frames needed adaptive search"
+    )
+    print("Slowest frames:")
+    print(profile.nlargest(n_slowest, "time_s").to_string(index=False))
@@ -5,8 +5,184 @@ import argparse
 import dask.array as da
 import numpy as np
 import zarr
-from skimage.measure import label, regionprops
-from skimage.morphology import dilation, remove_small_objects
+from scipy import ndimage as ndi
+
+from mask_io import MASK_FORMATS, create_mask_array, encode_masks
+from zarr_io import SHARD_SHAPE, shard_blocks, write_blocks
+
+# Frames of a block are labelled together, but the structuring elements
+# only connect pixels within the same frame.
+# 4-connectivity, as used by skimage.morphology.remove_small_objects
+FACE_CONNECTIVITY = np.zeros((3, 3, 3), dtype=bool)
+FACE_CONNECTIVITY[1] = ndi.generate_binary_structure(2, 1)
+# 8-connectivity, as used by skimage.measure.label
+FULL_CONNECTIVITY = np.zeros((3, 3, 3), dtype=bool)
+FULL_CONNECTIVITY[1] = True
+
+
+def __keep_by_area(mask: np.ndarray, structure: np.ndarray, keep_area) -> np.ndarray:
+    labels, _ = ndi.label(mask, structure=structure)
+
+    # Lookup table indexed by label, label 0 is the background
+    keep = keep_area(np.bincount(labels.ravel()))
+    keep[0] = False
+
+    return keep[labels]
+
+
+def __foreground_masks(
+    thresholded: np.ndarray, object_min_size: int, object_max_area: int
+) -> np.ndarray:
+    # Remove small objects
+    large = __keep_by_area(
+        thresholded, FACE_CONNECTIVITY, lambda areas: areas >= object_min_size
+    )
+
+    # Objects above the maximum area are not excluded
+    large = __keep_by_area(
+        large, FULL_CONNECTIVITY, lambda areas: areas <= object_max_area
+    )
+
+    return ndi.binary_dilation(large, structure=np.ones((1, 3, 3), dtype=bool))
+
+
+def exclusion_masks(
+    frames: np.ndarray,
+    threshold_value: int,
+    object_min_size: int,
+    object_max_area: int,
+) -> np.ndarray:
+    """Masks of the large objects of a (t, y, x) block of frames, computed frame by frame."""
+    return __foreground_masks(
+        frames > threshold_value, object_min_size, object_max_area
+    )
+
+
+def __incremental_exclusion_masks(
+    frames: np.ndarray,
+    threshold_value: int,
+    object_min_size: int,
+    object_max_area: int,
+    reuse_tolerance: float,
+    previous: tuple | None = None,
+) -> tuple[np.ndarray, tuple, int]:
+    """
+    Compute masks only for frames whose thresholded foreground differs from that of the last
+    computed frame by more than `reuse_tolerance` (fraction of pixels). Other frames reuse the
+    mask of the last computed frame. `previous` carries the (foreground, mask) of the last
+    computed frame from block to block.
+    """
+    thresholded = frames > threshold_value
+    max_changed = reuse_tolerance * thresholded[0].size
+
+    # Index of the mask used by each frame, -1 is the mask carried over
+    # from the previous block
+    mask_index = np.empty(len(frames), dtype=int)
+    computed = []
+    reference = previous[0] if previous is not None else None
+    for t in range(len(frames)):
+        if (
+            reference is None
+            or np.count_nonzero(thresholded[t] != reference) > max_changed
+        ):
+            computed.append(t)
+            reference = thresholded[t]
+        mask_index[t] = len(computed) - 1
+
+    masks = []
+    if previous is not None:
+        masks.append(previous[1][np.newaxis])
+        mask_index += 1
+    if computed:
+        masks.append(
+            __foreground_masks(thresholded[computed], object_min_size, object_max_area)
+        )
+    masks = np.concatenate(masks)
+
+    return masks[mask_index], (reference, masks[-1]), len(frames) - len(computed)
+
+
+def __mask_shard_block(
+    block_index: np.ndarray,
+    raw_path: str,
+    mask_path: str,
+    threshold_value: int,
+    object_min_size: int,
+    object_max_area: int,
+    mask_format: str,
+) -> np.ndarray:
+    # Arrays are opened by path in the task, so that nothing but the block
+    # index has to be sent to worker processes.
+    t0 = int(block_index[0]) * SHARD_SHAPE[0]
+    frames = zarr.open_array(raw_path, mode="r")[t0 : t0 + SHARD_SHAPE[0]]
+
+    masks = exclusion_masks(frames, threshold_value, object_min_size, object_max_area)
+    zarr.open_array(mask_path, mode="r+")[t0 : t0 + masks.shape[0]] = encode_masks(
+        masks, mask_format
+    )
+
+    return block_index
+
+
+def _exclusion_mask_stage(
+    frames: np.ndarray,
+    mask_format: str,
+    threshold_value: int = 50,
+    object_min_size: int = 30,
+    object_max_area: int = 3600,
+    workers: int = 1,
+) -> np.ndarray:
+    """Exclusion masks of a movie in memory, also written to large-objects.zarr."""
+    array = create_mask_array("large-objects.zarr", frames.shape, mask_format)
+    masks = np.empty(frames.shape, dtype=bool)
+
+    def __mask_blocks():
+        for block in shard_blocks(frames.shape[0]):
+            masks[block] = exclusion_masks(
+                frames[block], threshold_value, object_min_size, object_max_area
+            )
+            yield block.start, encode_masks(masks[block], mask_format)
+
+    write_blocks(array, __mask_blocks(), workers=workers)
+
+    return masks
+
+
+def _incremental_exclusion_mask_stage(
+    raw_da: da.Array,
+    array: zarr.Array,
+    mask_format: str,
+    reuse_tolerance: float,
+    threshold_value: int = 50,
+    object_min_size: int = 30,
+    object_max_area: int = 3600,
+    workers: int = 1,
+) -> int:
+    """
+    Exclusion masks of a movie read block by block, reusing masks of frames with unchanged
+    foreground, written to `array`. Returns the number of frames that reused a mask.
+    """
+    reused = 0
+
+    def __mask_blocks():
+        nonlocal reused
+        previous = None
+        for block in shard_blocks(raw_da.shape[0]):
+            masks, previous, block_reused = __incremental_exclusion_masks(
+                raw_da[block].compute(),
+                threshold_value,
+                object_min_size,
+                object_max_area,
+                reuse_tolerance,
+                previous,
+            )
+            reused += block_reused
+            yield block.start, encode_masks(masks, mask_format)
+
+    write_blocks(array, __mask_blocks(), workers=workers)
+
+    return reused
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Create exclusion mask")
@@ -20,41 +196,83 @@ if __name__ == "__main__":
     parser.add_argument(
         "--object-max-area", type=int, default=3600, help="Maximum object area"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of shard writer threads, or dask workers with --scheduler",
+    )
+    parser.add_argument(
+        "--mask-format",
+        type=str,
+        choices=MASK_FORMATS,
+        default="dense",
+        help="Store one boolean per pixel (dense) or bit-packed rows (packed)",
+    )
+    parser.add_argument(
+        "--scheduler",
+        type=str,
+        choices=["serial", "threads", "processes"],
+        default="serial",
+        help="Compute masks block by block in this process (serial), or map the "
+        "mask computation over shard blocks with a dask scheduler",
+    )
+    parser.add_argument(
+        "--reuse-tolerance",
+        type=float,
+        default=None,
+        help="Reuse the previous mask when at most this fraction of thresholded "
+        "pixels changed (serial scheduler only, 0 reuses identical frames only)",
+    )
 
     args = parser.parse_args()
 
-    raw_da = da.from_zarr(args.zarr_path)
+    if args.reuse_tolerance is not None and args.scheduler != "serial":
+        parser.error("--reuse-tolerance requires --scheduler serial")
 
-    large_objects = []
-    for t in range(raw_da.shape[0]):
-        thresholded = raw_da[t] > args.threshold_value
-        large = remove_small_objects(
-            thresholded.compute(), min_size=args.object_min_size
-        )
+    raw_da = da.from_zarr(args.zarr_path)
 
-        labels = label(large)
-        props = regionprops(labels)
-        for prop in props:
-            if prop.area > args.object_max_area:
-                large[labels == prop.label] = 0
+    array = create_mask_array("large-objects.zarr", raw_da.shape, args.mask_format)
 
-        large = dilation(large, footprint=np.ones((3, 3)))
-        large_objects.append(da.from_array(large))
+    if args.scheduler == "serial" and args.reuse_tolerance is not None:
+        reused = _incremental_exclusion_mask_stage(
+            raw_da,
+            array,
+            args.mask_format,
+            args.reuse_tolerance,
+            args.threshold_value,
+            args.object_min_size,
+            args.object_max_area,
+            args.workers,
+        )
 
-    large_objects = da.stack(large_objects)
-    large_objects = large_objects.rechunk()
+        print(
+            f"Reused masks for {reused} of {raw_da.shape[0]} frames "
+            f"(reuse ratio {reused / max(raw_da.shape[0], 1):.2f})"
+        )
+    elif args.scheduler == "serial":
 
-    array = zarr.create_array(
-        store="large-objects.zarr",
-        shape=large_objects.shape,
-        dtype=large_objects.dtype,
-        chunks=(1, 356, 356),
-        shards=(20, 712, 712),
-        compressors=zarr.codecs.BloscCodec(
-            cname="zstd", clevel=5, shuffle=zarr.codecs.BloscShuffle.shuffle
-        ),
-        zarr_format=3,
-        dimension_names=["t", "y", "x"],
-    )
+        def __mask_blocks():
+            for block in shard_blocks(raw_da.shape[0]):
+                masks = exclusion_masks(
+                    raw_da[block].compute(),
+                    args.threshold_value,
+                    args.object_min_size,
+                    args.object_max_area,
+                )
+                yield block.start, encode_masks(masks, args.mask_format)
 
-    array[:] = large_objects
+        write_blocks(array, __mask_blocks(), workers=args.workers)
+    else:
+        # One task per shard, each task reads, masks and writes its own shard
+        n_blocks = len(shard_blocks(raw_da.shape[0]))
+        da.arange(n_blocks, chunks=1).map_blocks(
+            __mask_shard_block,
+            args.zarr_path,
+            "large-objects.zarr",
+            args.threshold_value,
+            args.object_min_size,
+            args.object_max_area,
+            args.mask_format,
+            dtype=int,
+        ).compute(scheduler=args.scheduler, num_workers=args.workers)
@@ -0,0 +1,66 @@
+"""
+Storage formats for the exclusion masks. Masks are either stored densely as one boolean per pixel,
+or bit-packed along x into uint8 with a bitshuffle codec. Readers get a lazy boolean dask array in
+both cases, packed masks are expanded chunk by chunk when they are computed.
+"""
+
+import dask.array as da
+import numpy as np
+import zarr
+import zarr.codecs
+
+from zarr_io import CHUNK_SHAPE, SHARD_SHAPE, create_array
+
+MASK_FORMATS = ["dense", "packed"]
+
+
+def __packed_width(width: int) -> int:
+    return (width + 7) // 8
+
+
+def __unpack(block: np.ndarray, width: int) -> np.ndarray:
+    return np.unpackbits(block, axis=-1, count=width).astype(bool)
+
+
+def create_mask_array(store: str, shape: tuple, mask_format: str) -> zarr.Array:
+    if mask_format == "dense":
+        return create_array(store, shape, bool, dimension_names=["t", "y", "x"])
+
+    width = shape[-1]
+    packed_width = __packed_width(width)
+
+    array = create_array(
+        store,
+        shape[:-1] + (packed_width,),
+        np.uint8,
+        dimension_names=["t", "y", "x_packed"],
+        chunks=CHUNK_SHAPE[:-1] + (packed_width,),
+        shards=SHARD_SHAPE[:-1] + (packed_width,),
+        shuffle=zarr.codecs.BloscShuffle.bitshuffle,
+    )
+    array.attrs.update({"mask_format": "packed", "width": width})
+
+    return array
+
+
+def encode_masks(masks: np.ndarray, mask_format: str) -> np.ndarray:
+    if mask_format == "dense":
+        return masks
+
+    return np.packbits(masks, axis=-1)
+
+
+def open_mask(path: str) -> da.Array:
+    array = zarr.open_array(path, mode="r")
+    if array.attrs.get("mask_format", "dense") == "dense":
+        return da.from_zarr(array)
+
+    width = array.attrs["width"]
+    packed = da.from_zarr(array)
+
+    return packed.map_blocks(
+        __unpack,
+        width,
+        chunks=packed.chunks[:-1] + ((width,),),
+        dtype=bool,
+    )
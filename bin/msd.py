@@ -0,0 +1,185 @@
+"""
+Mean squared displacement of many tracks with the FFT (Wiener-Khinchin) algorithm. Every track is
+laid out on its full frame range with a presence mask, so gaps left by linking memory only remove
+the position pairs they touch, and tracks of similar length are correlated together in batches.
+Results match trackpy's imsd and emsd, except at lags of a track without any position pairs, where
+trackpy reports zero: these are NaN in the individual MSD and left out of the ensemble MSD, and
+lags without pairs in any track are missing from the ensemble MSD.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+
+# Upper bound on the elements of one batch of padded tracks
+BATCH_ELEMENTS = 2**24
+
+
+def __msd_n(n: np.ndarray, lag: np.ndarray) -> np.ndarray:
+    # Effective number of independent measurements, as in trackpy's _msd_N
+    n, lag = n.astype(np.float64), lag.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            lag > n / 2,
+            1
+            / (
+                1
+                + ((n - lag) ** 3 + 5 * lag - 4 * (n - lag) ** 2 * lag - n)
+                / (6 * (n - lag) * lag**2)
+            ),
+            6 * (n - lag) ** 2 * lag / (2 * n - lag + 4 * n * lag**2 - 5 * lag**3),
+        )
+
+
+def __correlate(a: np.ndarray, b: np.ndarray, n: int, max_lag: int) -> np.ndarray:
+    # sum_t a[t] * b[t + lag] for lags 1..max_lag along the last axis
+    spectrum = np.conj(fft.rfft(a, n=n)) * fft.rfft(b, n=n)
+    return fft.irfft(spectrum, n=n)[:, 1 : max_lag + 1]
+
+
+def __batch_msd(
+    mask: np.ndarray, x: np.ndarray, y: np.ndarray, n: int, max_lag: int
+) -> tuple[np.ndarray, np.ndarray]:
+    r2 = x**2 + y**2
+    pairs = np.rint(__correlate(mask, mask, n, max_lag))
+    squared = (
+        __correlate(mask, r2, n, max_lag)
+        + __correlate(r2, mask, n, max_lag)
+        - 2 * (__correlate(x, x, n, max_lag) + __correlate(y, y, n, max_lag))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(pairs > 0, squared / pairs, np.nan), pairs
+
+
+def msd_table(
+    particle: np.ndarray,
+    frame: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    mpp: float,
+    max_lagtime: int,
+) -> pd.DataFrame:
+    """
+    Individual MSD of every particle in long format, one row per particle and lag in frames up to
+    `max_lagtime` or the frame span of the track. Rows are sorted by particle and lag, `n_pairs` is
+    the number of position pairs averaged and `n_positions`/`span` describe the track. Lags without
+    any position pairs have a NaN MSD.
+    """
+    order = np.lexsort((frame, particle))
+    particle, frame = np.asarray(particle)[order], np.asarray(frame)[order]
+    x = np.asarray(x, dtype=np.float64)[order] * mpp
+    y = np.asarray(y, dtype=np.float64)[order] * mpp
+
+    starts = np.flatnonzero(np.r_[True, particle[1:] != particle[:-1]])[: len(frame)]
+    stops = np.r_[starts[1:], len(frame)]
+    first = frame[starts]
+    span = frame[stops - 1] - first + 1
+    max_lags = np.minimum(max_lagtime, span - 1)
+
+    # Positions relative to the track mean keep the correlations well conditioned
+    segment = np.repeat(np.arange(len(starts)), stops - starts)
+    counts = stops - starts
+    x -= (np.bincount(segment, weights=x, minlength=len(starts)) / counts)[segment]
+    y -= (np.bincount(segment, weights=y, minlength=len(starts)) / counts)[segment]
+    offset = frame - first[segment]
+
+    # Zero padding to at least span + max_lag avoids circular wrap-around,
+    # tracks with the same padded length share a batch
+    padded = 2 ** np.ceil(np.log2(span + max_lags)).astype(np.int64)
+
+    msd = [np.empty(0)] * len(starts)
+    pairs = [np.empty(0)] * len(starts)
+    for n in np.unique(padded):
+        tracks = np.flatnonzero((padded == n) & (max_lags > 0))
+        if len(tracks) == 0:
+            continue
+        batch_size = max(1, BATCH_ELEMENTS // n)
+        for batch in np.array_split(tracks, -(-len(tracks) // batch_size)):
+            rows = np.repeat(np.arange(len(batch)), counts[batch])
+            index = np.concatenate([np.arange(starts[i], stops[i]) for i in batch])
+            columns = offset[index]
+
+            mask = np.zeros((len(batch), n))
+            batch_x = np.zeros((len(batch), n))
+            batch_y = np.zeros((len(batch), n))
+            mask[rows, columns] = 1
+            batch_x[rows, columns] = x[index]
+            batch_y[rows, columns] = y[index]
+
+            max_lag = int(max_lags[batch].max())
+            batch_msd, batch_pairs = __batch_msd(mask, batch_x, batch_y, n, max_lag)
+            for row, i in enumerate(batch):
+                msd[i] = batch_msd[row, : max_lags[i]]
+                pairs[i] = batch_pairs[row, : max_lags[i]]
+
+    lags = np.maximum(max_lags, 0)
+    lag = np.concatenate([np.arange(1, n + 1) for n in lags] + [np.empty(0, int)])
+
+    return pd.DataFrame(
+        {
+            "particle": np.repeat(particle[starts], lags),
+            "lag": lag.astype(np.int64),
+            "msd": np.concatenate(msd + [np.empty(0)]),
+            "n_pairs": np.concatenate(pairs + [np.empty(0)]).astype(np.int64),
+            "n_positions": np.repeat(counts, lags),
+            "span": np.repeat(span, lags),
+        }
+    )
+
+
+def imsd(table: pd.DataFrame, fps: float) -> pd.DataFrame:
+    """Individual MSD in trackpy's layout, lag times as index and one column per particle."""
+    wide = table.pivot(index="lag", columns="particle", values="msd")
+    wide.index = wide.index.to_numpy(dtype=np.float64) / fps
+    wide.index.name = "lag time [s]"
+    wide.columns.name = None
+
+    return wide
+
+
+def individual_table(table: pd.DataFrame, fps: float) -> pd.DataFrame:
+    """Individual MSD in long format with lag times in seconds."""
+    return table.assign(lagt=table["lag"] / fps)[
+        ["particle", "lag", "lagt", "msd", "n_pairs"]
+    ]
+
+
+def ensemble_table(table: pd.DataFrame, fps: float) -> pd.DataFrame:
+    """
+    Ensemble MSD in long format, weighted by the effective number of independent measurements of
+    every particle and lag as in trackpy's emsd. Lags of a track without any position pairs are
+    left out, where trackpy counts them as zero displacement.
+    """
+    table = table[table["n_pairs"] > 0]
+    weights = __msd_n(table["span"].to_numpy(), table["lag"].to_numpy())
+    weights *= table["n_positions"].to_numpy() / table["span"].to_numpy()
+
+    sums = (
+        pd.DataFrame(
+            {
+                "lag": table["lag"].to_numpy(),
+                "weighted": table["msd"].to_numpy() * weights,
+                "weights": weights,
+                "n_pairs": table["n_pairs"].to_numpy(),
+                "n_particles": 1,
+            }
+        )
+        .groupby("lag")
+        .sum()
+        .reset_index()
+    )
+
+    return pd.DataFrame(
+        {
+            "lag": sums["lag"],
+            "lagt": sums["lag"] / fps,
+            "msd": sums["weighted"] / sums["weights"],
+            "n_pairs": sums["n_pairs"],
+            "n_particles": sums["n_particles"],
+        }
+    )
+
+
+def emsd(table: pd.DataFrame, fps: float) -> pd.Series:
+    """Ensemble MSD in trackpy's layout, a series indexed by lag time."""
+    return ensemble_table(table, fps).set_index("lagt")["msd"]
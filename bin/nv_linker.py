@@ -0,0 +1,264 @@
+"""
+Nearest-velocity linking on compact NumPy arrays, as an alternative to trackpy's
+NearestVelocityPredict. Positions are predicted with the velocity of the nearest particle of the
+recent velocity field, candidates are found with a KD-tree per frame, and candidates are assigned
+greedily by distance with a Numba-compiled kernel. Assignment is greedy rather than trackpy's
+optimal subnetwork solution, so tracks can differ in crowded frames.
+"""
+
+import time
+
+import numba
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# Subnetwork size above which adaptive search reduces the search range, and
+# candidate tracks per detection, as trackpy's Linker.MAX_SUB_NET_SIZE_ADAPTIVE
+# and Linker.MAX_NEIGHBORS
+ADAPTIVE_SUB_NET_SIZE = 15
+MAX_NEIGHBORS = 10
+
+
+@numba.njit(cache=True)
+def __find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@numba.njit(cache=True)
+def __subnets(tracks, detections, n_tracks, n_detections):
+    # Union-find over the bipartite candidate graph, detections are
+    # offset by n_tracks. Returns the subnet root of every track and the
+    # subnet sizes by root, counted in tracks.
+    parent = np.arange(n_tracks + n_detections)
+    for k in range(len(tracks)):
+        a = __find(parent, tracks[k])
+        b = __find(parent, n_tracks + detections[k])
+        if a != b:
+            parent[a] = b
+
+    roots = np.empty(n_tracks, dtype=np.int64)
+    sizes = np.zeros(n_tracks + n_detections, dtype=np.int64)
+    for i in range(n_tracks):
+        roots[i] = __find(parent, i)
+        sizes[roots[i]] += 1
+    return roots, sizes
+
+
+@numba.njit(cache=True)
+def __assign(tracks, detections, distances, n_tracks, n_detections):
+    order = np.argsort(distances, kind="mergesort")
+    track_used = np.zeros(n_tracks, dtype=np.bool_)
+    assigned = np.full(n_detections, -1, dtype=np.int64)
+    for k in order:
+        track, detection = tracks[k], detections[k]
+        if track_used[track] or assigned[detection] != -1:
+            continue
+        track_used[track] = True
+        assigned[detection] = track
+    return assigned
+
+
+def adaptive_candidates(
+    predicted: np.ndarray,
+    detections: np.ndarray,
+    search_range: float,
+    max_sub_net_size: int,
+    adaptive_stop: float | None = None,
+    adaptive_step: float = 0.95,
+    adaptive_sub_net_size: int = ADAPTIVE_SUB_NET_SIZE,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+    """
+    Candidate (track, detection) pairs within `search_range` of the `predicted` positions, at most
+    `MAX_NEIGHBORS` nearest tracks per detection. As in trackpy, the search range of every
+    subnetwork larger than `adaptive_sub_net_size` is reduced by `adaptive_step` until it is small
+    enough or its range reaches `adaptive_stop`, and subnetworks larger than `max_sub_net_size`
+    are an error. Returns the track and detection indices and the
+    distances of the remaining candidates, and the candidate count, largest subnetwork and number
+    of subnetwork search range reductions of the frame.
+    """
+    tracks = np.empty(0, dtype=np.int64)
+    detection_ids = np.empty(0, dtype=np.int64)
+    distances = np.empty(0, dtype=np.float64)
+    if len(predicted) > 0 and len(detections) > 0:
+        # Nearest tracks of every detection, missing neighbors have
+        # infinite distances
+        distances, tracks = cKDTree(predicted).query(
+            detections,
+            k=list(range(1, MAX_NEIGHBORS + 1)),
+            distance_upper_bound=np.nextafter(search_range, np.inf),
+        )
+        valid = np.isfinite(distances)
+        detection_ids = np.nonzero(valid)[0].astype(np.int64)
+        tracks, distances = tracks[valid].astype(np.int64), distances[valid]
+    n_candidates = len(tracks)
+
+    # Search range of the subnetwork of every candidate
+    ranges = np.full(n_candidates, float(search_range))
+    roots, sizes = __subnets(tracks, detection_ids, len(predicted), len(detections))
+
+    # Split oversized subnetworks with reduced search ranges
+    adaptive_steps = 0
+    while adaptive_stop is not None and len(tracks):
+        oversized = (sizes[roots[tracks]] > adaptive_sub_net_size) & (
+            ranges > adaptive_stop
+        )
+        if not oversized.any():
+            break
+
+        adaptive_steps += len(np.unique(roots[tracks[oversized]]))
+        ranges[oversized] *= adaptive_step
+        keep = distances <= ranges
+        tracks, detection_ids = tracks[keep], detection_ids[keep]
+        distances, ranges = distances[keep], ranges[keep]
+        roots, sizes = __subnets(tracks, detection_ids, len(predicted), len(detections))
+
+    largest = sizes.max(initial=0)
+    if largest > max_sub_net_size:
+        raise ValueError(f"Subnetwork contains {largest} tracks")
+
+    telemetry = {
+        "candidates": n_candidates,
+        "largest_subnet": largest,
+        "adaptive_steps": adaptive_steps,
+    }
+
+    return tracks, detection_ids, distances, telemetry
+
+
+def __predict(
+    recent: list, last_frame: np.ndarray, last_pos: np.ndarray, t: int
+) -> np.ndarray:
+    # Velocity field between the oldest and newest of the recent frames,
+    # for particles present in both
+    if len(recent) < 2:
+        return last_pos
+
+    t0, ids0, pos0 = recent[0]
+    t1, ids1, pos1 = recent[-1]
+    _, i0, i1 = np.intersect1d(ids0, ids1, assume_unique=True, return_indices=True)
+    if len(i1) == 0:
+        return last_pos
+
+    velocities = (pos1[i1] - pos0[i0]) / (t1 - t0)
+    _, nearest = cKDTree(pos1[i1]).query(last_pos)
+
+    return last_pos + velocities[nearest] * (t - last_frame)[:, np.newaxis]
+
+
+def link_nearest_velocity(
+    f: pd.DataFrame,
+    search_range: float,
+    memory: int = 0,
+    span: int = 20,
+    adaptive_stop: float | None = None,
+    adaptive_step: float = 0.95,
+    max_sub_net_size: int = 10000,
+    adaptive_sub_net_size: int = ADAPTIVE_SUB_NET_SIZE,
+) -> tuple[pd.DataFrame, list[dict]]:
+    """Link the features of `f`, returning the tracks and one telemetry row per frame."""
+    f = f.sort_values("frame", kind="stable")
+    frames = f["frame"].to_numpy(dtype=np.int64)
+    positions = f[["y", "x"]].to_numpy(dtype=np.float64)
+    particle = np.empty(len(f), dtype=np.int64)
+
+    # Per-track state, indexed by particle id
+    last_frame = np.empty(0, dtype=np.int64)
+    last_pos = np.empty((0, 2), dtype=np.float64)
+    recent = []
+
+    # Per-frame telemetry
+    profile = []
+
+    bounds = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1], True])
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        frame_start = time.perf_counter()
+        t = frames[start]
+        pos = positions[start:stop]
+        n_detections = stop - start
+
+        active = np.flatnonzero(t - last_frame <= memory + 1)
+        predicted = __predict(recent, last_frame[active], last_pos[active], t)
+
+        tracks, detections, distances, telemetry = adaptive_candidates(
+            predicted,
+            pos,
+            search_range,
+            max_sub_net_size,
+            adaptive_stop,
+            adaptive_step,
+            adaptive_sub_net_size,
+        )
+
+        assigned = __assign(tracks, detections, distances, len(active), n_detections)
+
+        # Unassigned detections start new tracks
+        ids = np.full(n_detections, -1, dtype=np.int64)
+        matched = assigned >= 0
+        ids[matched] = active[assigned[matched]]
+        new = ~matched
+        ids[new] = len(last_frame) + np.arange(np.count_nonzero(new))
+        last_frame = np.concatenate(
+            [last_frame, np.empty(np.count_nonzero(new), dtype=np.int64)]
+        )
+        last_pos = np.concatenate(
+            [last_pos, np.empty((np.count_nonzero(new), 2), dtype=np.float64)]
+        )
+        last_frame[ids] = t
+        last_pos[ids] = pos
+        particle[start:stop] = ids
+
+        recent.append((t, ids, pos))
+        recent = [frame for frame in recent if t - frame[0] < span]
+
+        profile.append(
+            {
+                "frame": t,
+                "detections": n_detections,
+                "active_tracks": len(active),
+                **telemetry,
+                "time_s": time.perf_counter() - frame_start,
+            }
+        )
+
+    f = f.copy()
+    f["particle"] = particle
+
+    return f, profile
+
+
+class NearestVelocityLinker:
+    def __init__(
+        self,
+        search_range: float,
+        memory: int = 0,
+        span: int = 20,
+        adaptive_stop: float | None = None,
+        adaptive_step: float = 0.95,
+        max_sub_net_size: int = 10000,
+        adaptive_sub_net_size: int = ADAPTIVE_SUB_NET_SIZE,
+    ):
+        self.search_range = search_range
+        self.memory = memory
+        self.span = span
+        self.adaptive_stop = adaptive_stop
+        self.adaptive_step = adaptive_step
+        self.max_sub_net_size = max_sub_net_size
+        self.adaptive_sub_net_size = adaptive_sub_net_size
+
+    def link(self, f: pd.DataFrame) -> pd.DataFrame:
+        t, self.profile = link_nearest_velocity(
+            f,
+            self.search_range,
+            self.memory,
+            self.span,
+            self.adaptive_stop,
+            self.adaptive_step,
+            self.max_sub_net_size,
+            self.adaptive_sub_net_size,
+        )
+
+        return t
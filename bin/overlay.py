@@ -0,0 +1,139 @@
+"""
+Vectorized rendering of detection and linking overlays. Features are sorted by frame once, and the
+circle perimeters of all features in a block of frames are drawn with a single indexing operation
+using a precomputed circle stencil. Overlays can also be rendered lazily from the raw data and a
+features/tracks table instead of being stored as RGB Zarr arrays.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import zarr
+from skimage import draw
+
+from zarr_io import SHARD_SHAPE
+
+RADIUS = 5
+DETECTION_COLOR = (0, 255, 0)
+OVERLAY_MODES = ["zarr", "lazy"]
+LINKING_COLOR_SEED = 874
+
+
+def linking_colors(tracks: pd.DataFrame, seed: int = LINKING_COLOR_SEED) -> np.ndarray:
+    """
+    One random RGB color per particle, returned per row of `tracks`. Particles draw their colors
+    in order of first appearance, so colors are reproducible from the tracks table alone.
+    """
+    rng = np.random.RandomState(seed)
+    particles = tracks["particle"].unique()
+    color_table = rng.randint(0, 256, (len(particles), 3)).astype(np.uint8)
+
+    return color_table[pd.Index(particles).get_indexer(tracks["particle"])]
+
+
+class OverlayRenderer:
+    def __init__(
+        self,
+        features: pd.DataFrame,
+        colors: np.ndarray | None = None,
+        radius: int = RADIUS,
+    ):
+        """
+        `colors` holds one RGB color per row of `features`, all features are drawn in the detection
+        color if it is not given.
+        """
+        # Stable sort, features of a frame are drawn in table order so that
+        # later features are drawn over earlier ones
+        order = np.argsort(features["frame"].to_numpy(), kind="stable")
+        self.frame = features["frame"].to_numpy(dtype=np.int64)[order]
+        # Truncation, as int() on each coordinate
+        self.y = features["y"].to_numpy(dtype=np.float64)[order].astype(np.int64)
+        self.x = features["x"].to_numpy(dtype=np.float64)[order].astype(np.int64)
+
+        if colors is None:
+            colors = np.tile(np.array(DETECTION_COLOR, dtype=np.uint8), (len(order), 1))
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)[order]
+
+        self.stencil_rr, self.stencil_cc = draw.circle_perimeter(0, 0, radius)
+
+    def render(self, frames: np.ndarray, first_frame: int = 0) -> np.ndarray:
+        """
+        Render overlays for a (t, y, x) block of grayscale frames starting at `first_frame`.
+        """
+        n_frames, height, width = frames.shape
+        rgb = np.repeat(frames[..., np.newaxis], 3, axis=-1)
+
+        start, stop = np.searchsorted(
+            self.frame, [first_frame, first_frame + n_frames], side="left"
+        )
+        if start == stop:
+            return rgb
+
+        # (features, stencil) pixel coordinates
+        rr = self.y[start:stop, np.newaxis] + self.stencil_rr
+        cc = self.x[start:stop, np.newaxis] + self.stencil_cc
+        tt = np.broadcast_to(
+            (self.frame[start:stop] - first_frame)[:, np.newaxis], rr.shape
+        )
+        colors = np.broadcast_to(
+            self.colors[start:stop, np.newaxis, :], rr.shape + (3,)
+        )
+
+        valid = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+        tt, rr, cc, colors = tt[valid], rr[valid], cc[valid], colors[valid]
+
+        # Numpy does not define which of duplicate indices is written last,
+        # keep the last feature drawn on every pixel explicitly
+        flat = (tt * height + rr) * width + cc
+        _, last = np.unique(flat[::-1], return_index=True)
+        last = len(flat) - 1 - last
+        rgb[tt[last], rr[last], cc[last]] = colors[last]
+
+        return rgb
+
+
+class LazyOverlay:
+    """
+    Overlay frames rendered on demand from a raw data Zarr array. Rendered shard blocks are kept in
+    an LRU cache. Detection overlays rendered this way are drawn on the raw frames, without the
+    exclusion fill applied during detection.
+    """
+
+    def __init__(
+        self,
+        raw_zarr_path: str,
+        features: pd.DataFrame,
+        colors: np.ndarray | None = None,
+        cache_blocks: int = 8,
+    ):
+        self.raw = zarr.open_array(raw_zarr_path, mode="r")
+        self.renderer = OverlayRenderer(features, colors)
+        self.shape = self.raw.shape + (3,)
+        self.dtype = self.raw.dtype
+        self._render_block = lru_cache(maxsize=cache_blocks)(self.__render_block)
+
+    def __render_block(self, block_index: int) -> np.ndarray:
+        t0 = block_index * SHARD_SHAPE[0]
+        rendered = self.renderer.render(self.raw[t0 : t0 + SHARD_SHAPE[0]], t0)
+        rendered.flags.writeable = False
+
+        return rendered
+
+    def frames(self, start: int, stop: int) -> np.ndarray:
+        stop = min(stop, self.shape[0])
+        if start >= stop:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+
+        first_block = start // SHARD_SHAPE[0]
+        last_block = (stop - 1) // SHARD_SHAPE[0]
+        blocks = [
+            self._render_block(block_index)
+            for block_index in range(first_block, last_block + 1)
+        ]
+        offset = first_block * SHARD_SHAPE[0]
+
+        return np.concatenate(blocks)[start - offset : stop - offset]
+
+    def frame(self, t: int) -> np.ndarray:
+        return self.frames(t, t + 1)[0]
@@ -1,30 +1,116 @@
 #! /usr/bin/env python
 
+"""
+Export the raw data and the detection and linking overlays as tiled BigTIFF files. Frames are read
+one shard block at a time and fed to tifffile tile by tile, so memory is bounded by a block of
+frames and tiles are compressed by a pool of threads.
+"""
+
 import argparse
+from typing import Callable, Iterator
 
-import dask.array as da
+import numpy as np
+import zarr
 from tifffile import imwrite
 
+from overlay import LazyOverlay, linking_colors
+from tables import read_table
+from zarr_io import SHARD_SHAPE
+
+TILE_SHAPE = (256, 256)
+
+
+def __tiles(
+    read_frames: Callable[[int, int], np.ndarray], n_frames: int
+) -> Iterator[np.ndarray]:
+    # Tiles of every frame in row-major order, incomplete edge tiles are
+    # zero-padded by tifffile
+    for t0 in range(0, n_frames, SHARD_SHAPE[0]):
+        block = np.asarray(read_frames(t0, min(t0 + SHARD_SHAPE[0], n_frames)))
+        for frame in block:
+            for y in range(0, frame.shape[0], TILE_SHAPE[0]):
+                for x in range(0, frame.shape[1], TILE_SHAPE[1]):
+                    yield frame[y : y + TILE_SHAPE[0], x : x + TILE_SHAPE[1]]
+
+
+def _write_tiff(
+    path: str,
+    read_frames: Callable[[int, int], np.ndarray],
+    shape: tuple,
+    dtype,
+    workers: int = 1,
+) -> None:
+    """Write frames returned by `read_frames(start, stop)` as a tiled, LZW compressed BigTIFF."""
+    imwrite(
+        path,
+        __tiles(read_frames, shape[0]),
+        shape=shape,
+        dtype=dtype,
+        photometric="rgb" if len(shape) == 4 else "minisblack",
+        tile=TILE_SHAPE,
+        compression="lzw",
+        bigtiff=True,
+        maxworkers=workers,
+    )
+
+
+def __zarr_reader(path: str) -> tuple[Callable[[int, int], np.ndarray], tuple, type]:
+    array = zarr.open_array(path, mode="r")
+
+    return lambda start, stop: array[start:stop], array.shape, array.dtype
+
+
+def __overlay_reader(
+    overlay: LazyOverlay,
+) -> tuple[Callable[[int, int], np.ndarray], tuple, type]:
+    return overlay.frames, overlay.shape, overlay.dtype
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
         "--raw-data-zarr", required=True, type=str, help="Path to raw data zarr"
     )
-    parser.add_argument(
-        "--detection-zarr", required=True, type=str, help="Path to detection zarr"
+    detection = parser.add_mutually_exclusive_group(required=True)
+    detection.add_argument("--detection-zarr", type=str, help="Path to detection zarr")
+    detection.add_argument(
+        "--detection-csv",
+        "--detection-table",
+        dest="detection_table",
+        type=str,
+        help="Path to detection table, overlays are rendered on demand",
+    )
+    linking = parser.add_mutually_exclusive_group(required=True)
+    linking.add_argument("--linking-zarr", type=str, help="Path to linking zarr")
+    linking.add_argument(
+        "--linking-csv",
+        "--linking-table",
+        dest="linking_table",
+        type=str,
+        help="Path to linking table, overlays are rendered on demand",
     )
     parser.add_argument(
-        "--linking-zarr", required=True, type=str, help="Path to linking zarr"
+        "--workers", type=int, default=1, help="Number of tile compression threads"
     )
 
     args = parser.parse_args()
 
-    # save_tiff_data(args.output_dir, args.replicate, args.sample)
-    raw_da = da.from_zarr(args.raw_data_zarr)
-    detection_da = da.from_zarr(args.detection_zarr)
-    linking_da = da.from_zarr(args.linking_zarr)
+    if args.detection_zarr:
+        detection = __zarr_reader(args.detection_zarr)
+    else:
+        detection = __overlay_reader(
+            LazyOverlay(args.raw_data_zarr, read_table(args.detection_table))
+        )
+
+    if args.linking_zarr:
+        linking = __zarr_reader(args.linking_zarr)
+    else:
+        tracks = read_table(args.linking_table)
+        linking = __overlay_reader(
+            LazyOverlay(args.raw_data_zarr, tracks, linking_colors(tracks))
+        )
 
-    imwrite("raw-data.tif", raw_da.compute(), compression="lzw")
-    imwrite("detection.tif", detection_da.compute(), compression="lzw")
-    imwrite("linking.tif", linking_da.compute(), compression="lzw")
+    _write_tiff("raw-data.tif", *__zarr_reader(args.raw_data_zarr), args.workers)
+    _write_tiff("detection.tif", *detection, args.workers)
+    _write_tiff("linking.tif", *linking, args.workers)
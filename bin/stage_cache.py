@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+
+"""
+Content-addressed cache of pipeline stage outputs. A stage is keyed by its input files and
+directories, the source of the stage script and of every local module it imports, and its
+parameters. When an entry with the same key exists in the cache directory, its outputs are copied
+instead of running the stage again. Every lookup is appended to a log in the cache directory for
+hit/miss statistics.
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Callable
+
+STATS_FILE = "stats.jsonl"
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+def fingerprint(path: str) -> str:
+    """
+    Digest of a file, or of the paths and contents of every file of a directory such as a Zarr
+    store. Contents rather than modification times are hashed, so stores rewritten identically by
+    uncached upstream stages keep their fingerprint. Fingerprinting reads the whole input once, as
+    the stages reading it do.
+    """
+    if not os.path.isdir(path):
+        return _file_digest(path)
+
+    digest = hashlib.blake2b()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            digest.update(_file_digest(file_path).encode())
+
+    return digest.hexdigest()
+
+
+def _local_modules(source: str) -> list[str]:
+    # Paths of the script and of the modules it imports, directly or
+    # through other modules, from the script's own directory
+    directory = os.path.dirname(os.path.abspath(source))
+    modules, pending = [], [os.path.abspath(source)]
+    while pending:
+        path = pending.pop()
+        if path in modules:
+            continue
+        modules.append(path)
+
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_path = os.path.join(directory, name.split(".")[0] + ".py")
+                if os.path.isfile(module_path):
+                    pending.append(module_path)
+
+    return sorted(modules)
+
+
+def _copy(source: str, destination: str) -> None:
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+class StageCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage: str, inputs: list[str], parameters: dict, source: str) -> str:
+        digest = hashlib.blake2b()
+        digest.update(stage.encode())
+        digest.update(json.dumps(parameters, sort_keys=True).encode())
+        for module_path in _local_modules(source):
+            digest.update(os.path.basename(module_path).encode())
+            digest.update(_file_digest(module_path).encode())
+        for path in inputs:
+            digest.update(fingerprint(path).encode())
+
+        return digest.hexdigest()[:32]
+
+    def __record(self, stage: str, key: str, hit: bool, seconds: float) -> None:
+        entry = {"stage": stage, "key": key, "hit": hit, "seconds": seconds}
+        with open(os.path.join(self.cache_dir, STATS_FILE), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def fetch(self, key: str, outputs: list[str]) -> bool:
+        entry = os.path.join(self.cache_dir, key)
+        if not all(os.path.exists(os.path.join(entry, path)) for path in outputs):
+            return False
+
+        for path in outputs:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            _copy(os.path.join(entry, path), path)
+
+        return True
+
+    def store(self, key: str, outputs: list[str]) -> None:
+        # Stages without some of their outputs, e.g. of an empty sample,
+        # are not cached
+        if not all(os.path.exists(path) for path in outputs):
+            return
+
+        # Entries appear atomically, concurrent runs of the same stage
+        # keep whichever entry was stored first
+        entry = os.path.join(self.cache_dir, key)
+        staging = f"{entry}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(staging)
+        for path in outputs:
+            _copy(path, os.path.join(staging, path))
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging)
+
+    def run(
+        self,
+        stage: str,
+        inputs: list[str],
+        parameters: dict,
+        source: str,
+        outputs: list[str],
+        compute: Callable[[], object],
+    ) -> bool:
+        """Fetch the outputs of a stage, or compute and store them. Returns True on a hit."""
+        start = time.perf_counter()
+        key = self.key(stage, inputs, parameters, source)
+
+        hit = self.fetch(key, outputs)
+        if not hit:
+            compute()
+            self.store(key, outputs)
+
+        self.__record(stage, key, hit, time.perf_counter() - start)
+        print(f"Stage cache {'hit' if hit else 'miss'} for {stage} ({key})")
+
+        return hit
+
+    def stats(self) -> dict:
+        stats = {}
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        if not os.path.exists(path):
+            return stats
+
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                stage = stats.setdefault(entry["stage"], {"hits": 0, "misses": 0})
+                stage["hits" if entry["hit"] else "misses"] += 1
+
+        return stats
+
+
+def run_cached(
+    cache_dir: str | None,
+    stage: str,
+    inputs: list[str],
+    parameters: dict,
+    source: str,
+    outputs: list[str],
+    compute: Callable[[], object],
+) -> None:
+    """Run a stage through the cache in `cache_dir`, or directly without a cache directory."""
+    if cache_dir is None:
+        compute()
+        return
+
+    StageCache(cache_dir).run(stage, inputs, parameters, source, outputs, compute)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show stage cache statistics")
+    parser.add_argument("--cache-dir", type=str, required=True, help="Cache directory")
+    args = parser.parse_args()
+
+    for stage, counts in sorted(StageCache(args.cache_dir).stats().items()):
+        lookups = counts["hits"] + counts["misses"]
+        print(
+            f"{stage}: {counts['hits']} hits, {counts['misses']} misses "
+            f"(hit rate {counts['hits'] / lookups:.2f})"
+        )
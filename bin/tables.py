@@ -0,0 +1,104 @@
+"""
+Tables passed between pipeline stages, stored as csv or Parquet. Readers pick the format from the
+file extension, so a stage reads whatever the previous stage wrote. Parquet keeps column types and
+skips text parsing, csv stays available for export.
+"""
+
+import os
+
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+TABLE_FORMATS = ["csv", "parquet"]
+
+
+def table_path(name: str, table_format: str) -> str:
+    return f"{name}.{table_format}"
+
+
+def _is_parquet(path: str) -> bool:
+    return os.path.splitext(path)[1] == ".parquet"
+
+
+def read_table(path: str) -> pd.DataFrame:
+    if _is_parquet(path):
+        return pd.read_parquet(path)
+
+    return pd.read_csv(path)
+
+
+def read_polars_table(path: str) -> pl.DataFrame:
+    if _is_parquet(path):
+        return pl.read_parquet(path)
+
+    return pl.read_csv(path)
+
+
+def write_table(df: pd.DataFrame | pl.DataFrame, path: str, **csv_kwargs) -> None:
+    """
+    Write a pandas or Polars table. Keyword arguments only apply to csv, Parquet tables are
+    written without the pandas index.
+    """
+    if isinstance(df, pl.DataFrame):
+        if _is_parquet(path):
+            df.write_parquet(path)
+        else:
+            df.write_csv(path, **csv_kwargs)
+    elif _is_parquet(path):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, **csv_kwargs)
+
+
+class TableWriter:
+    """
+    Append pandas tables block by block to one csv or Parquet file. The first non-empty block fixes
+    the columns and their order, empty blocks may lack columns and are skipped. An empty table is
+    written if every block was empty.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__columns = None
+        self.__writer = None
+        self.__empty = None
+
+    def append(self, df: pd.DataFrame) -> None:
+        if len(df) == 0:
+            if self.__empty is None:
+                self.__empty = df
+            return
+
+        started = self.__columns is not None
+        if started:
+            df = df[self.__columns]
+        else:
+            self.__columns = list(df.columns)
+
+        if not _is_parquet(self.path):
+            df.to_csv(
+                self.path,
+                index=False,
+                header=not started,
+                mode="a" if started else "w",
+            )
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.__writer is None:
+                self.__writer = pq.ParquetWriter(self.path, table.schema)
+            self.__writer.write_table(table.cast(self.__writer.schema))
+
+    def close(self) -> None:
+        if self.__writer is not None:
+            self.__writer.close()
+        elif self.__columns is None:
+            df = self.__empty if self.__empty is not None else pd.DataFrame()
+            write_table(df, self.path, index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
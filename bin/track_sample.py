@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+"""
+Track one sample in a single process: exclusion masks, detection, linking and metrics run on one
+decompressed copy of the raw movie, and tables are passed between the stages in memory. Every stage
+still writes the outputs of its standalone script.
+"""
+
+import argparse
+
+import dask.array as da
+import polars as pl
+
+from calculate_metrics import MSD_ENGINES, MSD_FORMATS, _metrics_stage
+from detect_objects import _detection_stage
+from link_objects import _linking_stage
+from make_exclusion_masks import _exclusion_mask_stage
+from mask_io import MASK_FORMATS
+from overlay import OVERLAY_MODES
+from tables import TABLE_FORMATS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track objects of one sample")
+
+    parser.add_argument(
+        "--raw-data-zarr", type=str, required=True, help="Path to raw data zarr"
+    )
+    parser.add_argument(
+        "--replicate-name", type=str, required=True, help="Replicate name"
+    )
+    parser.add_argument("--sample-name", type=str, required=True, help="Sample name")
+    parser.add_argument(
+        "--mask-format",
+        type=str,
+        choices=MASK_FORMATS,
+        default="dense",
+        help="Store one boolean per pixel (dense) or bit-packed rows (packed)",
+    )
+    parser.add_argument(
+        "--overlay-mode",
+        type=str,
+        choices=OVERLAY_MODES,
+        default="zarr",
+        help="Write detection.zarr and linking.zarr (zarr), or only the tables for "
+        "overlays rendered on demand (lazy)",
+    )
+    parser.add_argument(
+        "--table-format",
+        type=str,
+        choices=TABLE_FORMATS,
+        default="csv",
+        help="Format of the detection, linking, tracking data and particles tables",
+    )
+    parser.add_argument(
+        "--msd-engine",
+        type=str,
+        choices=MSD_ENGINES,
+        default="fft",
+        help="Compute MSD with the gap-aware FFT algorithm or with trackpy",
+    )
+    parser.add_argument(
+        "--msd-format",
+        type=str,
+        choices=MSD_FORMATS,
+        default="csv",
+        help="Write MSD as wide csv tables or as long Parquet tables",
+    )
+    parser.add_argument(
+        "--export-csv",
+        action="store_true",
+        help="Also write particles.csv when tables are written as parquet",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes locating features",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of shard writer threads"
+    )
+
+    args = parser.parse_args()
+
+    if args.msd_format == "parquet" and args.msd_engine != "fft":
+        parser.error("--msd-format parquet requires --msd-engine fft")
+
+    raw_da = da.from_zarr(args.raw_data_zarr)
+    assert raw_da.ndim == 3, "Expected 2D time-series data"
+    assert raw_da.shape[1] == 712
+    assert raw_da.shape[2] == 712
+    assert raw_da.dtype == "uint8"
+
+    frames = raw_da[:, :, :].compute()
+
+    exclude = _exclusion_mask_stage(frames, args.mask_format, workers=args.workers)
+
+    f = _detection_stage(
+        frames,
+        exclude,
+        args.processes,
+        args.workers,
+        args.overlay_mode,
+        args.table_format,
+    )
+    del exclude
+
+    t = _linking_stage(
+        f,
+        frames if args.overlay_mode == "zarr" else None,
+        args.workers,
+        args.table_format,
+    )
+    del frames
+
+    _metrics_stage(
+        pl.from_pandas(t.reset_index(drop=True)),
+        args.replicate_name,
+        args.sample_name,
+        args.msd_engine,
+        args.msd_format,
+        args.table_format,
+        args.export_csv,
+    )
@@ -0,0 +1,152 @@
+"""
+Parallel linking of overlapping time windows. The detection table is split into windows that
+overlap by at least the linking memory, each window is linked on its own process with the nearest
+velocity predictor, and the windows are stitched by matching particle identities of the detections
+they share.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+
+def __link_window(
+    f: pd.DataFrame, span: int, max_sub_net_size: int, link_parameters: dict
+) -> pd.DataFrame:
+    if len(f) == 0:
+        return f.assign(particle=pd.Series(dtype=np.int64))
+
+    tp.quiet()
+    tp.linking.Linker.MAX_SUB_NET_SIZE = max_sub_net_size
+    pred = tp.predict.NearestVelocityPredict(span=span)
+
+    return pred.link_df(f, **link_parameters)
+
+
+def __window_bounds(
+    first_frame: int, last_frame: int, n_windows: int, overlap: int
+) -> list[tuple[int, int]]:
+    # Half-open [start, stop) frame ranges, every window but the last one
+    # extends `overlap` frames into the next
+    length = -(-(last_frame - first_frame + 1) // n_windows)
+    starts = [first_frame + i * length for i in range(n_windows)]
+
+    return [(start, min(start + length + overlap, last_frame + 1)) for start in starts]
+
+
+def __match_particles(previous: pd.DataFrame, current: pd.DataFrame) -> dict:
+    """
+    Map particle ids of `current` to ids of `previous` by majority vote over the detections the
+    two windows share. Each previous id is used at most once, best supported matches first.
+    """
+    shared = previous.index.intersection(current.index)
+    pairs = pd.DataFrame(
+        {
+            "previous": previous.loc[shared, "particle"].to_numpy(),
+            "current": current.loc[shared, "particle"].to_numpy(),
+        }
+    )
+    votes = pairs.value_counts().reset_index(name="votes")
+    votes = votes.sort_values("votes", ascending=False, kind="stable")
+
+    mapping = {}
+    used = set()
+    for previous_id, current_id in zip(votes["previous"], votes["current"]):
+        if current_id in mapping or previous_id in used:
+            continue
+        mapping[current_id] = previous_id
+        used.add(previous_id)
+
+    return mapping
+
+
+def link_windows(
+    f: pd.DataFrame,
+    n_windows: int,
+    overlap: int,
+    span: int,
+    max_sub_net_size: int,
+    link_parameters: dict,
+) -> pd.DataFrame:
+    assert overlap >= link_parameters.get("memory", 0), "Overlap must cover memory"
+
+    bounds = __window_bounds(
+        int(f["frame"].min()), int(f["frame"].max()), n_windows, overlap
+    )
+    windows = [f[(f["frame"] >= start) & (f["frame"] < stop)] for start, stop in bounds]
+
+    with ProcessPoolExecutor(max_workers=n_windows) as pool:
+        futures = [
+            pool.submit(__link_window, window, span, max_sub_net_size, link_parameters)
+            for window in windows
+        ]
+        linked = [future.result() for future in futures]
+
+    # Each window contributes its frames up to the middle of the overlap
+    # with the next window, where both windows had full context
+    cuts = [(bounds[i + 1][0] + bounds[i][1]) // 2 for i in range(n_windows - 1)]
+    cuts = [-np.inf] + cuts + [np.inf]
+
+    stitched = []
+    previous = None
+    next_id = 0
+    for i, window in enumerate(linked):
+        window = window.copy()
+        mapping = __match_particles(previous, window) if previous is not None else {}
+        for particle in window["particle"].unique():
+            if particle not in mapping:
+                mapping[particle] = next_id
+                next_id += 1
+        window["particle"] = window["particle"].map(mapping)
+
+        stitched.append(
+            window[(window["frame"] >= cuts[i]) & (window["frame"] < cuts[i + 1])]
+        )
+        previous = window
+
+    # Same row order as linking the whole table at once
+    return pd.concat(stitched).sort_index().sort_values("frame", kind="stable")
+
+
+def __link_pairs(t: pd.DataFrame) -> set:
+    # Consecutive detections of every track, as pairs of detection row ids
+    t = t.sort_values(["particle", "frame"], kind="stable")
+    rows = t.index.to_numpy()
+    same = t["particle"].to_numpy()[1:] == t["particle"].to_numpy()[:-1]
+
+    return set(zip(rows[:-1][same], rows[1:][same]))
+
+
+def validation_report(
+    reference: pd.DataFrame,
+    candidate: pd.DataFrame,
+    names: tuple[str, str] = ("serial", "windowed"),
+) -> pd.DataFrame:
+    """
+    Track count and length statistics of two linking results of the same detections, and the
+    fraction of frame-to-frame links they agree on.
+    """
+    rows = []
+    for name, t in zip(names, [reference, candidate]):
+        lengths = t.groupby("particle").size()
+        rows.append(
+            {
+                "linking": name,
+                "tracks": len(lengths),
+                "mean_length": lengths.mean(),
+                "median_length": lengths.median(),
+                "max_length": lengths.max(),
+            }
+        )
+    report = pd.DataFrame(rows).set_index("linking")
+
+    reference_pairs = __link_pairs(reference)
+    candidate_pairs = __link_pairs(candidate)
+    union = reference_pairs | candidate_pairs
+    report["link_agreement"] = (
+        len(reference_pairs & candidate_pairs) / len(union) if union else 1.0
+    )
+
+    return report
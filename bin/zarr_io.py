@@ -0,0 +1,78 @@
+"""
+Shared helpers for writing the pipeline's sharded Zarr arrays. Blocks are written shard by shard so
+that independent shards can be encoded concurrently by a pool of worker threads.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+import numpy as np
+import zarr
+import zarr.codecs
+
+CHUNK_SHAPE = (1, 356, 356)
+SHARD_SHAPE = (20, 712, 712)
+
+
+def create_array(
+    store: str,
+    shape: tuple,
+    dtype,
+    dimension_names: list[str],
+    chunks: tuple = CHUNK_SHAPE,
+    shards: tuple = SHARD_SHAPE,
+    shuffle: zarr.codecs.BloscShuffle = zarr.codecs.BloscShuffle.shuffle,
+) -> zarr.Array:
+    # Trailing dimensions (e.g. RGB channels) are never split
+    trailing = tuple(shape[len(shards) :])
+
+    return zarr.create_array(
+        store=store,
+        shape=shape,
+        dtype=dtype,
+        chunks=chunks + trailing,
+        shards=shards + trailing,
+        compressors=zarr.codecs.BloscCodec(cname="zstd", clevel=5, shuffle=shuffle),
+        zarr_format=3,
+        dimension_names=dimension_names,
+    )
+
+
+def shard_blocks(n_frames: int, block_frames: int = SHARD_SHAPE[0]) -> list[slice]:
+    assert block_frames % SHARD_SHAPE[0] == 0, "Blocks must be aligned to shards"
+
+    return [
+        slice(t0, min(t0 + block_frames, n_frames))
+        for t0 in range(0, n_frames, block_frames)
+    ]
+
+
+def write_blocks(
+    array: zarr.Array, blocks: Iterable[tuple[int, np.ndarray]], workers: int = 1
+) -> int:
+    """
+    Write (start frame, block) pairs to a Zarr array. Blocks are produced by the calling thread and
+    encoded by up to `workers` threads, with at most `workers` blocks in flight at any time.
+    Returns the number of bytes written.
+    """
+
+    def __write(t0: int, block: np.ndarray) -> int:
+        array[t0 : t0 + block.shape[0]] = block
+        return block.nbytes
+
+    if workers <= 1:
+        return sum(__write(t0, block) for t0, block in blocks)
+
+    written = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for t0, block in blocks:
+            if len(pending) >= workers:
+                written += pending.popleft().result()
+            pending.append(pool.submit(__write, t0, block))
+
+        while pending:
+            written += pending.popleft().result()
+
+    return written
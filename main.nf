@@ -1,3 +1,9 @@
+params.maskFormat = "packed"
+params.msdFormat = "csv"
+params.tableFormat = "parquet"
+params.fusedTracking = false
+params.cacheDir = null
+
 workflow {
 
     rawDataChannel = Channel.fromPath("${params.rawDataDir}/*/*.nd2")
@@ -9,24 +15,31 @@ workflow {
 
 
     ConvertND2ToZarr(rawDataChannel).set { rawDataZarrChannel }
-    MakeExclusionMasks(ConvertND2ToZarr.out)
-    DetectObjects(MakeExclusionMasks.out).set { detectObjectsChannel }
-    LinkObjects(DetectObjects.out).set { linkObjectsChannel }
-    CalculateMetrics(LinkObjects.out)
-
-
-    tiffDataChannel = rawDataZarrChannel
-        .combine(detectObjectsChannel, by: [0, 1])
-        .combine(linkObjectsChannel, by: [0, 1])
-        .map { i ->
-            def replicateName = i[0]
-            def sampleName = i[1]
-            def rawDataZarr = i[2]
-            def detectionZarr = i[4]
-            def linkingZarr = i[7]
-
-            return tuple(replicateName, sampleName, rawDataZarr, detectionZarr, linkingZarr)
-        }
+
+    if (params.fusedTracking) {
+        // Masks, detection, linking and metrics in one process per sample
+        TrackSample(ConvertND2ToZarr.out)
+        tiffDataChannel = TrackSample.out.tiffData
+    } else {
+        MakeExclusionMasks(ConvertND2ToZarr.out)
+        DetectObjects(MakeExclusionMasks.out).set { detectObjectsChannel }
+        LinkObjects(DetectObjects.out).set { linkObjectsChannel }
+        CalculateMetrics(LinkObjects.out)
+
+
+        tiffDataChannel = rawDataZarrChannel
+            .combine(detectObjectsChannel, by: [0, 1])
+            .combine(linkObjectsChannel, by: [0, 1])
+            .map { i ->
+                def replicateName = i[0]
+                def sampleName = i[1]
+                def rawDataZarr = i[2]
+                def detectionZarr = i[4]
+                def linkingZarr = i[7]
+
+                return tuple(replicateName, sampleName, rawDataZarr, detectionZarr, linkingZarr)
+            }
+    }
 
     SaveTiffData(tiffDataChannel)
 }
@@ -44,7 +57,9 @@ process ConvertND2ToZarr {
     script:
     """
     convert_nd2_to_zarr.py \
-        --nd2-path ${nd2Path}
+        --nd2-path ${nd2Path} \
+        --streaming \
+        --workers ${task.cpus}
     """
 }
 
@@ -59,59 +74,102 @@ process MakeExclusionMasks {
 
     script:
     """
-    make_exclusion_masks.py --zarr-path raw-data.zarr
+    make_exclusion_masks.py \
+        --zarr-path raw-data.zarr \
+        --mask-format ${params.maskFormat} \
+        --scheduler processes \
+        --workers ${task.cpus}
     """
 }
 
 process DetectObjects {
-    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: "copy", pattern: "detection.{zarr,csv}"
+    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: "copy", pattern: "detection.{zarr,csv,parquet}"
 
     input:
     tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('large-objects.zarr')
 
     output:
-    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('detection.zarr'), path('detection.csv')
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('detection.zarr'), path("detection.${params.tableFormat}")
 
     script:
     """
     detect_objects.py \
         --raw-data-zarr raw-data.zarr \
-        --large-objects-zarr large-objects.zarr
+        --large-objects-zarr large-objects.zarr \
+        --streaming \
+        --block-frames ${20 * task.cpus} \
+        --processes ${task.cpus} \
+        --workers ${task.cpus} \
+        --table-format ${params.tableFormat} \
+        ${params.cacheDir ? "--cache-dir ${params.cacheDir}" : ""}
     """
 }
 
 process LinkObjects {
-    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: "copy", pattern: "linking.{zarr,csv}"
+    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: "copy", pattern: "linking.{zarr,csv,parquet}"
 
     input:
-    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('detection.zarr'), path('detection.csv')
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('detection.zarr'), path("detection.${params.tableFormat}")
 
     output:
-    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('linking.zarr'), path('linking.csv')
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('linking.zarr'), path("linking.${params.tableFormat}")
 
     script:
     """
     link_objects.py \
         --raw-data-zarr raw-data.zarr \
-        --detection-csv detection.csv
+        --detection-table detection.${params.tableFormat} \
+        --workers ${task.cpus} \
+        --table-format ${params.tableFormat} \
+        ${params.cacheDir ? "--cache-dir ${params.cacheDir}" : ""}
     """
 }
 
 process CalculateMetrics {
-    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: 'copy', pattern: '*.csv'
+    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: 'copy', pattern: '*.{csv,parquet}'
 
     input:
-    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('linking.zarr'), path('linking.csv')
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('linking.zarr'), path("linking.${params.tableFormat}")
 
     output:
-    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('particles.csv'), path('emsd.csv'), path('imsd.csv')
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('particles.csv'), path('emsd.*'), path('imsd.*')
 
     script:
     """
     calculate_metrics.py \
         --replicate-name ${replicateName} \
         --sample-name ${sampleName} \
-        --linking-csv linking.csv
+        --linking-table linking.${params.tableFormat} \
+        --msd-format ${params.msdFormat} \
+        --table-format ${params.tableFormat} \
+        --export-csv \
+        ${params.cacheDir ? "--cache-dir ${params.cacheDir}" : ""}
+    """
+}
+
+process TrackSample {
+    publishDir "${params.outputDir}/${replicateName}/${sampleName}", mode: "copy", pattern: "{large-objects,detection,linking,additional-tracking-data,tracks,particles,emsd,imsd}.*"
+
+    input:
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr')
+
+    output:
+    tuple val(replicateName), val(sampleName), path('raw-data.zarr'), path('detection.zarr'), path('linking.zarr'), emit: tiffData
+    tuple val(replicateName), val(sampleName), path('large-objects.zarr'), path("detection.${params.tableFormat}"), path("linking.${params.tableFormat}"), emit: tables
+    tuple val(replicateName), val(sampleName), path('particles.csv'), path('emsd.*'), path('imsd.*'), emit: metrics
+
+    script:
+    """
+    track_sample.py \
+        --raw-data-zarr raw-data.zarr \
+        --replicate-name ${replicateName} \
+        --sample-name ${sampleName} \
+        --mask-format ${params.maskFormat} \
+        --table-format ${params.tableFormat} \
+        --msd-format ${params.msdFormat} \
+        --export-csv \
+        --processes ${task.cpus} \
+        --workers ${task.cpus}
     """
 }
 
@@ -129,6 +187,7 @@ process SaveTiffData {
     save_tiff_data.py \
         --raw-data-zarr raw-data.zarr \
         --detection-zarr detection.zarr \
-        --linking-zarr linking.zarr
+        --linking-zarr linking.zarr \
+        --workers ${task.cpus}
     """
 }
@@ -3,20 +3,26 @@ Module for cleaning raw data by removing large particles. This will help to avoi
 """
 
 import os
+import sys
 
 import dask.array as da
-import numpy as np
 import zarr
-
-# from skimage.measure import label
-from skimage.morphology import dilation, remove_small_objects
-from skimage.measure import label, regionprops
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from make_exclusion_masks import exclusion_masks  # noqa: E402
+
 ZARR_PATH = os.path.join(
     os.path.dirname(__file__), "..", "data", "silke-zoospore-data.zarr"
 )
 
+BLOCK_FRAMES = 20
+
+THRESHOLD_VALUE = 50
+OBJECT_MIN_SIZE = 30
+OBJECT_MAX_AREA = 3600
+
 
 def make_exclusion_masks(
     replicate: str, experiment: str, zarr_path: str = ZARR_PATH, overwrite: bool = True
@@ -33,21 +39,14 @@ def make_exclusion_masks(
 
     large_objects = []
 
-    for t in range(raw_da.shape[0]):
-        thresholded = raw_da[t] > 50
-        large = remove_small_objects(thresholded.compute(), min_size=30)
-
-        labels = label(large)
-        props = regionprops(labels)
-        for prop in props:
-            if prop.area > 3600:
-                large[labels == prop.label] = 0
-
-        large = dilation(large, footprint=np.ones((3, 3)))
-
-        large_objects.append(da.from_array(large))
+    for t in range(0, raw_da.shape[0], BLOCK_FRAMES):
+        frames = raw_da[t : t + BLOCK_FRAMES].compute()
+        masks = exclusion_masks(
+            frames, THRESHOLD_VALUE, OBJECT_MIN_SIZE, OBJECT_MAX_AREA
+        )
+        large_objects.append(da.from_array(masks))
 
-    large_objects = da.stack(large_objects)
+    large_objects = da.concatenate(large_objects)
 
     large_objects = large_objects.rechunk()
     large_objects.to_zarr(
@@ -5,16 +5,18 @@ Run this script to start the Dash app that displays the particle tracking data.
 import os
 
 import dash_bootstrap_components as dbc
-import plotly.express as px
-import polars as pl
 from dash import Dash, Input, Output, callback_context
 from dotenv import load_dotenv
-from joblib import Parallel, delayed
-from tqdm import tqdm
 
+from util.particle_data import (
+    read_manifest,
+    scan_particle_data,
+    scan_shared_particle_data,
+)
 from visualization.layout import create_layout
+from visualization.violin import ViolinSummaries
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "tracking-data")
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "particle-data")
 
 METRICS = [
     {
@@ -44,62 +46,20 @@ METRICS = [
 ]
 
 
-def load_particle_data(data_dir: str = DATA_DIR) -> pl.DataFrame:
-    sample_data = [
-        (replicate, sample)
-        for replicate in os.listdir(data_dir)
-        if os.path.isdir(os.path.join(data_dir, replicate))
-        for sample in os.listdir(os.path.join(data_dir, replicate))
-        if os.path.isdir(os.path.join(data_dir, replicate, sample))
-    ]
-
-    def __compile_particle_data(td):
-        replicate, sample = td
-        try:
-            tracks_csv_path = os.path.join(data_dir, replicate, sample, "tracks.csv")
-            particles_csv_path = os.path.join(
-                data_dir, replicate, sample, "particles.csv"
-            )
-
-            tracks_df = pl.read_csv(tracks_csv_path)
-            particle_df = pl.read_csv(particles_csv_path)
-
-            test = tracks_df["test"][0]
-            step_init_abs = str(tracks_df["step_init_abs"][0]).zfill(2)
-            step_end_abs = str(tracks_df["step_end_abs"][0]).zfill(2)
-
-            data_dict = {
-                "replicate": replicate,
-                "sample": sample,
-                "test": test,
-                "step": f"{step_init_abs}-{step_end_abs}",
-            }
-
-            return pl.DataFrame({**data_dict, **particle_df.to_dict()})
-        except Exception as e:
-            if isinstance(e, pl.exceptions.NoDataError) or isinstance(
-                e, FileNotFoundError
-            ):
-                return pl.DataFrame()
-
-    all_particle_df = Parallel(n_jobs=-1)(
-        delayed(__compile_particle_data)(td)
-        for td in tqdm(sample_data, desc="Loading particle data")
-    )
-
-    all_particle_df = pl.concat([df for df in all_particle_df if not df.is_empty()])
-    all_particle_df = all_particle_df.sort(
-        [
-            "replicate",
-            "sample",
-            "particle_id",
-        ]
-    )
+def _get_particle_data_format():
+    load_dotenv(dotenv_path=".env")
+    load_dotenv(dotenv_path=".env.local")
 
-    return all_particle_df
+    # Production servers set "arrow" to share one memory-mapped file across workers
+    return os.getenv("PARTICLE_DATA_FORMAT", "parquet")
 
 
-particles_df = load_particle_data(DATA_DIR)
+manifest = read_manifest(DATA_DIR)
+if _get_particle_data_format() == "arrow":
+    particles = scan_shared_particle_data(DATA_DIR)
+else:
+    particles = scan_particle_data(DATA_DIR)
+violins = ViolinSummaries(particles, manifest["replicates"])
 
 
 def _get_url_base_pathname():
@@ -122,9 +82,9 @@ server = app.server
 
 
 app.layout = create_layout(
-    replicates=sorted(particles_df["replicate"].unique().to_list()),
+    replicates=manifest["replicates"],
     metrics=METRICS,
-    steps=sorted(particles_df["step"].unique(), reverse=True),
+    steps=manifest["steps"],
 )
 
 
@@ -135,29 +95,15 @@ app.layout = create_layout(
     Input("steps-dropdown", "value"),
 )
 def update_graph(selected_replicates: list, selected_metric: str, selected_steps: list):
-    filtered_particles_df = particles_df.filter(
-        (pl.col("replicate").is_in(selected_replicates))
-        & (pl.col("step").is_in(selected_steps))
-    )
-
     filtered_metric = list(filter(lambda x: x["value"] == selected_metric, METRICS))
 
-    fig = px.violin(
-        filtered_particles_df,
-        y=selected_metric,
-        color="replicate",
-        facet_col="step",
-        facet_col_wrap=10,
-        height=1024,
-        labels={selected_metric: filtered_metric[0]["label"]},
-        template="plotly_dark",
-        category_orders={
-            "step": sorted(filtered_particles_df["step"].unique(), reverse=True)
-        },
+    return violins.figure(
+        tuple(selected_replicates),
+        selected_metric,
+        tuple(selected_steps),
+        filtered_metric[0]["label"],
     )
 
-    return fig
-
 
 @app.callback(
     Output("steps-dropdown", "value"),
@@ -168,16 +114,16 @@ def update_steps_dropdown(select_all_clicks, select_none_clicks):
     ctx = callback_context
 
     if not ctx.triggered:
-        return sorted(particles_df["step"].unique(), reverse=True)
+        return manifest["steps"]
 
     button_id = ctx.triggered[0]["prop_id"].split(".")[0]
 
     if button_id == "select-all-button":
-        return sorted(particles_df["step"].unique(), reverse=True)
+        return manifest["steps"]
     elif button_id == "select-none-button":
         return []
 
-    return sorted(particles_df["step"].unique(), reverse=True)
+    return manifest["steps"]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+"""
+Gunicorn settings for serving the Dash app, run from src with `gunicorn -c gunicorn.conf.py
+wsgi:server`. Every worker loads the app and scans the same memory-mapped Arrow file of the
+particle dataset. The app is not preloaded since Polars is not fork-safe once its thread pool is
+used.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8050")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+preload_app = False
@@ -74,22 +74,27 @@ def link_detections(
     t = t[t["mass"] <= 900]
     t = t[t["size"] <= 1.8]
 
-    groups = t.groupby("particle")
-    area_covered_df = pd.DataFrame()
-    for name, group in groups:
-        if len(group) >= 3:
-            hull = ConvexHull(group[["x", "y"]])
-            area = hull.volume
-            area_covered_df = pd.concat(
-                [area_covered_df, pd.DataFrame({"particle": [name], "area": [area]})]
-            )
-
     # Filter out particles that don't cover enough area.
     # This will remove particles that have little to no movement.
     # This setting is important in reducing the low-level noise in the data.
-    area_covered_df.set_index("particle", inplace=True)
     threshold = 15**2  # 25 pixels squared
-    particles_to_keep = area_covered_df[area_covered_df["area"] > threshold].index
+
+    # Hulls lie within the bounding box, only particles with a bounding box
+    # larger than the threshold need a hull
+    groups = t.groupby("particle")
+    extent = groups[["x", "y"]].max() - groups[["x", "y"]].min()
+    candidates = extent.index[
+        (extent["x"] * extent["y"] > threshold) & (groups.size() >= 3)
+    ]
+
+    particles_to_keep = pd.Index(
+        [
+            name
+            for name, group in t[t["particle"].isin(candidates)].groupby("particle")
+            if ConvexHull(group[["x", "y"]]).volume > threshold
+        ],
+        name="particle",
+    )
 
     t = t[t["particle"].isin(particles_to_keep)]
     t.to_csv(
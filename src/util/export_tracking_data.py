@@ -45,6 +45,12 @@ with alive_bar(len(sample_data)) as bar:
         imsd_csv_path = os.path.join(
             args.data_dir, replicate, sample, "tracking-data", "imsd.csv"
         )
+        emsd_parquet_path = os.path.join(
+            args.data_dir, replicate, sample, "tracking-data", "emsd.parquet"
+        )
+        imsd_parquet_path = os.path.join(
+            args.data_dir, replicate, sample, "tracking-data", "imsd.parquet"
+        )
         particles_csv_path = os.path.join(
             args.data_dir, replicate, sample, "tracking-data", "particles.csv"
         )
@@ -61,6 +67,9 @@ with alive_bar(len(sample_data)) as bar:
             shutil.copy(emsd_csv_path, output_dir_path)
         if os.path.isfile(imsd_csv_path):
             shutil.copy(imsd_csv_path, output_dir_path)
+        for msd_parquet_path in [emsd_parquet_path, imsd_parquet_path]:
+            if os.path.isfile(msd_parquet_path):
+                shutil.copy(msd_parquet_path, output_dir_path)
         if os.path.isfile(particles_csv_path):
             shutil.copy(particles_csv_path, output_dir_path)
         if os.path.isfile(tracks_csv_path):
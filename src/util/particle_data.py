@@ -0,0 +1,214 @@
+"""
+Compact the particle metrics of every sample into one Parquet dataset for the Dash app. Sample
+descriptors are joined to the particle rows once, the dataset is partitioned by replicate and step
+and a small manifest lists its replicates, steps and samples, so the app does not walk the
+tracking data directories on startup. The dataset is also written as one Arrow file that served
+app workers memory-map.
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+import polars as pl
+import pyarrow.parquet as pq
+from joblib import Parallel, delayed
+from tqdm import tqdm
+
+TRACKING_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", "tracking-data"
+)
+PARTICLE_DATA_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", "particle-data"
+)
+DATASET_DIR = "particles"
+MANIFEST_FILE = "manifest.json"
+ARROW_FILE = "particles.arrow"
+PARTITION_COLUMNS = ["replicate", "step"]
+
+# Tables holding the sample descriptors in their rows, in order of preference
+DESCRIPTOR_TABLES = [
+    "tracks.csv",
+    "additional-tracking-data.parquet",
+    "additional-tracking-data.csv",
+]
+PARTICLE_TABLES = ["particles.parquet", "particles.csv"]
+
+
+def __first_table(sample_dir: str, names: list[str]) -> str | None:
+    for name in names:
+        path = os.path.join(sample_dir, name)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def __read_table(path: str, columns: list[str] | None = None, n_rows=None):
+    if path.endswith(".parquet"):
+        return pl.read_parquet(path, columns=columns, n_rows=n_rows)
+
+    return pl.read_csv(path, columns=columns, n_rows=n_rows)
+
+
+def __sample_particles(tracking_dir: str, replicate: str, sample: str) -> pl.DataFrame:
+    sample_dir = os.path.join(tracking_dir, replicate, sample)
+    descriptors_path = __first_table(sample_dir, DESCRIPTOR_TABLES)
+    particles_path = __first_table(sample_dir, PARTICLE_TABLES)
+    if descriptors_path is None or particles_path is None:
+        return pl.DataFrame()
+
+    try:
+        # Descriptors are constant within a sample, the first row is enough
+        descriptors = __read_table(
+            descriptors_path, ["test", "step_init_abs", "step_end_abs"], n_rows=1
+        )
+        particle_df = __read_table(particles_path)
+    except pl.exceptions.NoDataError:
+        return pl.DataFrame()
+
+    if descriptors.is_empty() or particle_df.is_empty():
+        return pl.DataFrame()
+
+    step_init_abs = str(descriptors["step_init_abs"][0]).zfill(2)
+    step_end_abs = str(descriptors["step_end_abs"][0]).zfill(2)
+
+    return particle_df.select(
+        pl.lit(replicate).alias("replicate"),
+        pl.lit(sample).alias("sample"),
+        pl.lit(descriptors["test"][0]).alias("test"),
+        pl.lit(f"{step_init_abs}-{step_end_abs}").alias("step"),
+        pl.all(),
+    )
+
+
+def compact_particle_data(
+    tracking_dir: str = TRACKING_DIR, output_dir: str = PARTICLE_DATA_DIR
+) -> dict:
+    """
+    Write the particle metrics of all samples under `tracking_dir` as a Parquet dataset
+    partitioned by replicate and step, and its manifest. Returns the manifest.
+    """
+    sample_data = [
+        (replicate, sample)
+        for replicate in os.listdir(tracking_dir)
+        if os.path.isdir(os.path.join(tracking_dir, replicate))
+        for sample in os.listdir(os.path.join(tracking_dir, replicate))
+        if os.path.isdir(os.path.join(tracking_dir, replicate, sample))
+    ]
+
+    particle_dfs = Parallel(n_jobs=-1)(
+        delayed(__sample_particles)(tracking_dir, replicate, sample)
+        for replicate, sample in tqdm(sample_data, desc="Compacting particle data")
+    )
+    particles_df = pl.concat(
+        [df for df in particle_dfs if not df.is_empty()], how="diagonal_relaxed"
+    ).sort(["replicate", "sample", "particle_id"])
+
+    dataset_dir = os.path.join(output_dir, DATASET_DIR)
+    if os.path.isdir(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    pq.write_to_dataset(
+        particles_df.to_arrow(),
+        dataset_dir,
+        partition_cols=PARTITION_COLUMNS,
+        basename_template="part-{i}.parquet",
+    )
+
+    samples = particles_df.group_by(["replicate", "sample", "test", "step"]).agg(
+        pl.len().alias("particles")
+    )
+    manifest = {
+        "dataset": DATASET_DIR,
+        "partitioning": PARTITION_COLUMNS,
+        "columns": particles_df.columns,
+        "rows": len(particles_df),
+        "replicates": sorted(particles_df["replicate"].unique().to_list()),
+        "steps": sorted(particles_df["step"].unique().to_list(), reverse=True),
+        "samples": samples.sort(["replicate", "sample"]).to_dicts(),
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    write_arrow_file(output_dir)
+
+    return manifest
+
+
+def read_manifest(data_dir: str = PARTICLE_DATA_DIR) -> dict:
+    with open(os.path.join(data_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def scan_particle_data(data_dir: str = PARTICLE_DATA_DIR) -> pl.LazyFrame:
+    """
+    Lazy scan of the compacted particle dataset. Filters on replicate and step prune partitions
+    and only the selected columns are read.
+    """
+    manifest = read_manifest(data_dir)
+    dataset_dir = os.path.join(data_dir, manifest["dataset"])
+
+    return pl.scan_parquet(
+        os.path.join(dataset_dir, "**", "*.parquet"),
+        hive_partitioning=True,
+        hive_schema={column: pl.String for column in manifest["partitioning"]},
+        try_parse_hive_dates=False,
+    )
+
+
+def write_arrow_file(data_dir: str = PARTICLE_DATA_DIR) -> str:
+    """
+    Write the compacted dataset as one uncompressed Arrow IPC file for multi-worker serving. The
+    file is replaced atomically, so running apps never see a partial file. Returns its path.
+    """
+    path = os.path.join(data_dir, ARROW_FILE)
+    manifest = read_manifest(data_dir)
+    staging = f"{path}.{os.getpid()}.tmp"
+    scan_particle_data(data_dir).select(manifest["columns"]).sort(
+        PARTITION_COLUMNS
+    ).collect().write_ipc(staging, compression="uncompressed")
+    os.replace(staging, path)
+
+    return path
+
+
+def scan_shared_particle_data(data_dir: str = PARTICLE_DATA_DIR) -> pl.LazyFrame:
+    """
+    Lazy scan of the memory-mapped Arrow file of the compacted dataset. Processes scanning the same
+    file share its pages through the page cache instead of holding their own copy. The file is
+    only written by the compaction step, a missing file or one older than the manifest is an error.
+    """
+    path = os.path.join(data_dir, ARROW_FILE)
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(
+        manifest_path
+    ):
+        raise FileNotFoundError(
+            f"Missing or stale {path}, rerun the particle data compaction"
+        )
+
+    return pl.scan_ipc(path, memory_map=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tracking-dir",
+        type=str,
+        default=TRACKING_DIR,
+        help="Directory containing the exported tracking data",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=PARTICLE_DATA_DIR,
+        help="Directory where the particle dataset and its manifest are written",
+    )
+    args = parser.parse_args()
+
+    manifest = compact_particle_data(args.tracking_dir, args.output_dir)
+    print(
+        f"{manifest['rows']} particles of {len(manifest['samples'])} samples "
+        f"written to {args.output_dir}"
+    )
@@ -0,0 +1,204 @@
+"""
+Violin plots of particle metrics drawn from precomputed summaries instead of raw points. The KDE
+curve and quartiles of every replicate, step and metric are computed once on the server, and
+figures are cached per selection, so callbacks and the browser only handle a fixed number of curve
+points per violin whatever the number of particles.
+"""
+
+import math
+from functools import lru_cache
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+import polars as pl
+from plotly.subplots import make_subplots
+
+KDE_POINTS = 128
+FACET_COL_WRAP = 10
+VIOLIN_HALF_WIDTH = 0.45
+BOX_WIDTH = 0.1
+TEMPLATE = "plotly_dark"
+
+
+def __bandwidth(values: np.ndarray) -> float:
+    # Silverman's rule of thumb, as used by plotly.js violins
+    q1, q3 = np.percentile(values, [25, 75])
+    spread = min(np.std(values), (q3 - q1) / 1.349) or np.std(values)
+    bandwidth = 1.059 * spread * len(values) ** -0.2
+
+    return bandwidth if bandwidth > 0 else max(abs(float(values[0])), 1.0) * 1e-3
+
+
+def violin_summary(values: np.ndarray) -> dict | None:
+    """
+    KDE curve and box statistics of the finite `values`. The density is evaluated on `KDE_POINTS`
+    points spanning two bandwidths beyond the data, from a histogram of the values on the same
+    grid, and scaled to a maximum of 1. Returns None without any finite values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None
+
+    bandwidth = __bandwidth(values)
+    grid = np.linspace(
+        values.min() - 2 * bandwidth, values.max() + 2 * bandwidth, KDE_POINTS
+    )
+    step = grid[1] - grid[0]
+    bins = np.clip(
+        np.rint((values - grid[0]) / step).astype(np.int64), 0, KDE_POINTS - 1
+    )
+    counts = np.bincount(bins, minlength=KDE_POINTS)
+
+    offsets = (np.arange(KDE_POINTS)[:, np.newaxis] - np.arange(KDE_POINTS)) * step
+    density = np.exp(-0.5 * (offsets / bandwidth) ** 2) @ counts
+
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+
+    return {
+        "y": grid,
+        "density": density / density.max(),
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "lowerfence": values[values >= q1 - 1.5 * iqr].min(),
+        "upperfence": values[values <= q3 + 1.5 * iqr].max(),
+        "n": len(values),
+    }
+
+
+class ViolinSummaries:
+    """
+    Violin figures of a lazily scanned particles table faceted by step and colored by replicate.
+    Summaries are computed once per replicate, step and metric by scans reading only the missing
+    partitions and the metric column, and figures are kept in an LRU cache keyed on the selection.
+    """
+
+    def __init__(
+        self, particles: pl.LazyFrame, replicates: list[str], cache_figures: int = 64
+    ):
+        self.particles = particles
+        self.summaries = {}
+        # Colors follow all replicates, so a replicate keeps its color in every selection
+        colorway = pio.templates[TEMPLATE].layout.colorway
+        self.colors = {
+            replicate: colorway[i % len(colorway)]
+            for i, replicate in enumerate(sorted(replicates))
+        }
+        self.figure = lru_cache(maxsize=cache_figures)(self.__figure)
+
+    def _summaries(
+        self, replicates: list[str], metric: str, steps: list[str]
+    ) -> dict[tuple[str, str], dict]:
+        missing = [
+            (replicate, step)
+            for replicate in replicates
+            for step in steps
+            if (metric, replicate, step) not in self.summaries
+        ]
+        if missing:
+            groups = (
+                self.particles.filter(
+                    pl.col("replicate").is_in({replicate for replicate, _ in missing})
+                    & pl.col("step").is_in({step for _, step in missing})
+                )
+                .group_by("replicate", "step")
+                .agg(pl.col(metric))
+                .collect()
+            )
+            values = {
+                (replicate, step): group_values
+                for replicate, step, group_values in groups.iter_rows()
+            }
+            # Selections without particles are cached as None as well
+            for replicate, step in missing:
+                self.summaries[(metric, replicate, step)] = violin_summary(
+                    np.array(values.get((replicate, step), []), dtype=np.float64)
+                )
+
+        return {
+            (replicate, step): self.summaries[(metric, replicate, step)]
+            for replicate in replicates
+            for step in steps
+            if self.summaries[(metric, replicate, step)] is not None
+        }
+
+    def __figure(
+        self, replicates: tuple, metric: str, steps: tuple, label: str
+    ) -> go.Figure:
+        replicates = sorted(replicates)
+        summaries = self._summaries(replicates, metric, list(steps))
+        steps = sorted(
+            {
+                step
+                for step in steps
+                for replicate in replicates
+                if (replicate, step) in summaries
+            },
+            reverse=True,
+        )
+        if not steps:
+            return go.Figure(layout={"template": TEMPLATE, "height": 1024})
+
+        n_cols = min(len(steps), FACET_COL_WRAP)
+        fig = make_subplots(
+            rows=math.ceil(len(steps) / FACET_COL_WRAP),
+            cols=n_cols,
+            shared_yaxes="all",
+            horizontal_spacing=0.01,
+            vertical_spacing=0.05,
+            subplot_titles=[f"step={step}" for step in steps],
+        )
+        in_legend = set()
+
+        for i, step in enumerate(steps):
+            row, col = i // FACET_COL_WRAP + 1, i % FACET_COL_WRAP + 1
+            for position, replicate in enumerate(replicates):
+                summary = summaries.get((replicate, step))
+                if summary is None:
+                    continue
+
+                color = self.colors[replicate]
+                showlegend = replicate not in in_legend
+                in_legend.add(replicate)
+                half_width = VIOLIN_HALF_WIDTH * summary["density"]
+                fig.add_trace(
+                    go.Scatter(
+                        x=np.r_[position - half_width, position + half_width[::-1]],
+                        y=np.r_[summary["y"], summary["y"][::-1]],
+                        fill="toself",
+                        mode="lines",
+                        line={"color": color, "width": 1},
+                        name=replicate,
+                        legendgroup=replicate,
+                        showlegend=showlegend,
+                        hoverinfo="skip",
+                    ),
+                    row=row,
+                    col=col,
+                )
+                fig.add_trace(
+                    go.Box(
+                        x=[position],
+                        q1=[summary["q1"]],
+                        median=[summary["median"]],
+                        q3=[summary["q3"]],
+                        lowerfence=[summary["lowerfence"]],
+                        upperfence=[summary["upperfence"]],
+                        width=BOX_WIDTH,
+                        marker_color=color,
+                        name=replicate,
+                        legendgroup=replicate,
+                        showlegend=False,
+                    ),
+                    row=row,
+                    col=col,
+                )
+
+        fig.update_xaxes(showticklabels=False, range=[-0.5, len(replicates) - 0.5])
+        fig.update_yaxes(title_text=label, col=1)
+        fig.update_layout(template=TEMPLATE, height=1024, legend_title_text="replicate")
+
+        return fig
@@ -1,4 +1,9 @@
-from data_app import app
+import os
+
+# Workers scan the shared memory-mapped Arrow file of the particle dataset
+os.environ.setdefault("PARTICLE_DATA_FORMAT", "arrow")
+
+from data_app import app  # noqa: E402
 
 server = app.server
 